@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for filtered_logger and encrypt_password
+"""
+import io
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+filtered_logger = __import__('filtered_logger')
+encrypt_password = __import__('encrypt_password')
+
+
+def make_fields(count: int) -> list:
+    """builds count PII field names"""
+    return ["pii_{:03d}".format(i) for i in range(count)]
+
+
+def make_message(fields: list) -> str:
+    """builds a log line with every field plus a few safe ones"""
+    pairs = ["{}=value{}".format(field, i) for i, field in enumerate(fields)]
+    pairs += ["ip=127.0.0.1", "last_login=2019-11-14 06:14:24"]
+    return ";".join(pairs) + ";"
+
+
+def lines_per_sec(func, fields: list, message: str,
+                  min_time: float = 0.5) -> float:
+    """runs func on message until min_time is spent,
+    returns the rate in lines per second"""
+    lines = 0
+    start = time.perf_counter()
+    elapsed = 0.0
+    while elapsed < min_time:
+        func(fields, "***", message, ";")
+        lines += 1
+        elapsed = time.perf_counter() - start
+    return lines / elapsed
+
+
+def bench_filter_datum() -> None:
+    """compares filter_datum with the per field re.sub version"""
+    print("filter_datum (lines/sec)")
+    print("{:>8} {:>14} {:>14} {:>8}".format("fields", "sequential",
+                                             "compiled", "speedup"))
+    for count in (5, 50, 500):
+        fields = make_fields(count)
+        message = make_message(fields)
+        old = filtered_logger.filter_datum_sequential
+        new = filtered_logger.filter_datum
+        assert old(fields, "***", message, ";") == \
+            new(fields, "***", message, ";")
+        old_rate = lines_per_sec(old, fields, message)
+        new_rate = lines_per_sec(new, fields, message)
+        print("{:>8} {:>14.0f} {:>14.0f} {:>7.1f}x".format(
+            count, old_rate, new_rate, new_rate / old_rate))
+
+
+def bench_formatter_cache(loggers: int = 500, field_sets: int = 10) -> None:
+    """builds many formatters over a few overlapping field sets
+    and times construction plus the first log line of each"""
+    cache = filtered_logger.REDACTOR_CACHE
+    cache.clear()
+    sets = [tuple(filtered_logger.PII_FIELDS) + tuple(make_fields(i))
+            for i in range(field_sets)]
+    record = logging.LogRecord("user_data", logging.INFO, __file__, 0,
+                               make_message(sets[-1]), None, None)
+    worst = 0.0
+    start = time.perf_counter()
+    for i in range(loggers):
+        begin = time.perf_counter()
+        formatter = filtered_logger.RedactingFormatter(sets[i % field_sets])
+        formatter.format(record)
+        worst = max(worst, time.perf_counter() - begin)
+    total = time.perf_counter() - start
+    print("RedactingFormatter construction + first log")
+    print("{} formatters: {:.2f} ms total, {:.1f} us mean, "
+          "{:.1f} us worst".format(loggers, total * 1e3,
+                                   total / loggers * 1e6, worst * 1e6))
+    print(cache.info())
+
+
+def caller_latencies(logger: logging.Logger, message: str,
+                     count: int) -> list:
+    """times each logger.info call as seen by the caller"""
+    timings = []
+    for _ in range(count):
+        begin = time.perf_counter()
+        logger.info(message)
+        timings.append(time.perf_counter() - begin)
+    timings.sort()
+    return timings
+
+
+def bench_async_logger(count: int = 20000) -> None:
+    """compares the latency logging adds to the caller
+    for the sync and async get_logger"""
+    message = make_message(make_fields(50))
+    devnull = open(os.devnull, "w")
+    print("get_logger caller latency (us), {} lines".format(count))
+    print("{:>22} {:>8} {:>8} {:>8}".format("mode", "p50", "p99", "max"))
+    modes = [("sync", {}),
+             ("async block", {"async_": True, "overflow": "block"}),
+             ("async drop_oldest", {"async_": True,
+                                    "overflow": "drop_oldest"}),
+             ("async drop_newest", {"async_": True,
+                                    "overflow": "drop_newest"})]
+    for name, kwargs in modes:
+        logger = filtered_logger.get_logger(**kwargs)
+        handler = logger.handlers[0]
+        listener = getattr(handler, "listener", None)
+        if listener is not None:
+            listener.handlers[0].setStream(devnull)
+        else:
+            handler.setStream(devnull)
+        timings = caller_latencies(logger, message, count)
+        dropped = getattr(handler, "dropped", 0)
+        filtered_logger.flush_loggers()
+        print("{:>22} {:>8.1f} {:>8.1f} {:>8.1f}  dropped={}".format(
+            name, timings[len(timings) // 2] * 1e6,
+            timings[int(len(timings) * 0.99)] * 1e6,
+            timings[-1] * 1e6, dropped))
+    devnull.close()
+
+
+def make_users_db(rows: int) -> sqlite3.Connection:
+    """in-memory stand-in for get_db() with a filled users table"""
+    db = sqlite3.connect(":memory:")
+    db.execute("CREATE TABLE users (name TEXT, email TEXT, phone TEXT, "
+               "ssn TEXT, password TEXT, ip TEXT, last_login TEXT, "
+               "user_agent TEXT)")
+    db.executemany("INSERT INTO users VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                   (("user {}".format(i), "u{}@example.com".format(i),
+                     "(473) 401-4253", "261-72-6780", "K5?BMNv",
+                     "60ed:c396:2ff:244", "2019-11-14 06:14:24",
+                     "Mozilla/5.0") for i in range(rows)))
+    return db
+
+
+def bench_export(rows: int = 200000) -> None:
+    """compares the streaming export with logging row by row
+    and with formatting + filter_datum row by row"""
+    db = make_users_db(rows)
+    print("users dump, {} rows (rows/sec)".format(rows))
+
+    logger = filtered_logger.get_logger()
+    logger.handlers[0].setStream(io.StringIO())
+    start = time.perf_counter()
+    cursor = db.cursor()
+    cursor.execute("SELECT * FROM users;")
+    columns = [column[0] for column in cursor.description]
+    for row in cursor:
+        logger.info(";".join("{}={}".format(k, v)
+                             for k, v in zip(columns, row)).strip())
+    elapsed = time.perf_counter() - start
+    print("{:>22} {:>10.0f}".format("logger per row", rows / elapsed))
+
+    start = time.perf_counter()
+    cursor = db.cursor()
+    cursor.execute("SELECT * FROM users;")
+    for row in cursor:
+        filtered_logger.filter_datum(
+            filtered_logger.PII_FIELDS, "***",
+            ";".join("{}={}".format(k, v)
+                     for k, v in zip(columns, row)).strip(), ";")
+    elapsed = time.perf_counter() - start
+    print("{:>22} {:>10.0f}".format("filter_datum per row", rows / elapsed))
+
+    for batch_size in (100, 1000, 10000):
+        count, elapsed = filtered_logger.export_users(db, io.StringIO(),
+                                                      batch_size)
+        assert count == rows
+        print("{:>22} {:>10.0f}".format(
+            "export batch={}".format(batch_size), count / elapsed))
+    db.close()
+
+
+def make_csv(path: str, lines: int) -> None:
+    """writes a CSV export of lines records, with the header
+    and quoting of user_data.csv"""
+    header = "name,email,phone,ssn,password,ip,last_login,user_agent\n"
+    row = ('"Marlene Wood","hwestiii@att.net","(473) 401-4253",'
+           '"261-72-6780","K5?BMNv","60ed:c396:2ff:244:bbd0:9208:26f2:93ea",'
+           '"2019-11-14 06:14:24","Mozilla/5.0"\n')
+    block = row * 10000
+    with open(path, "w") as f:
+        f.write(header)
+        for _ in range(lines // 10000):
+            f.write(block)
+        f.write(row * (lines % 10000))
+
+
+def bench_parallel(lines: int = 10000000) -> None:
+    """throughput of redact_file from 1 to cpu_count workers"""
+    cores = os.cpu_count() or 1
+    with tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, "dump.csv")
+        make_csv(src, lines)
+        print("redact_file, {} records (records/sec)".format(lines))
+        workers = 1
+        base = None
+        while True:
+            with open(os.devnull, "w") as out:
+                count, elapsed = filtered_logger.redact_file(
+                    src, out, workers=workers)
+            assert count == lines
+            rate = count / elapsed
+            base = base or rate
+            print("{:>10} workers {:>12.0f} {:>7.2f}x".format(
+                workers, rate, rate / base))
+            if workers >= cores:
+                break
+            workers = min(workers * 2, cores)
+
+
+class FakeConnection:
+    """stand-in for a mysql.connector connection: connecting takes
+    the time of a handshake, a query opens a transaction that lasts
+    until rollback"""
+
+    handshake = 0.002
+
+    def __init__(self, fail_rollback: bool = False):
+        time.sleep(self.handshake)
+        self.connected = True
+        self.in_transaction = False
+        self.fail_rollback = fail_rollback
+
+    def is_connected(self) -> bool:
+        return self.connected
+
+    def query(self) -> None:
+        self.in_transaction = True
+
+    def rollback(self) -> None:
+        if self.fail_rollback:
+            raise OSError("connection lost")
+        self.in_transaction = False
+
+    def close(self) -> None:
+        self.connected = False
+
+
+def check_pool() -> None:
+    """checks ConnectionPool against FakeConnection"""
+    pool = filtered_logger.ConnectionPool(FakeConnection, min_size=1,
+                                          max_size=2, checkout_timeout=0.05)
+    # the next borrower does not inherit the transaction
+    with pool.acquire() as conn:
+        conn.query()
+        first = conn._conn
+    with pool.acquire() as conn:
+        assert conn._conn is first and not conn.in_transaction
+    # a dead connection is replaced on checkout
+    first.connected = False
+    with pool.acquire() as conn:
+        assert conn._conn is not first and conn.is_connected()
+    assert pool.metrics()["discarded"] == 1
+    # a checkout past max_size waits, then fails
+    held = [pool.acquire(), pool.acquire()]
+    try:
+        pool.acquire()
+        raise AssertionError("checkout past max_size")
+    except TimeoutError:
+        pass
+    assert pool.metrics()["exhausted"] == 1
+    # a connection that cannot be rolled back is dropped
+    held[0]._conn.fail_rollback = True
+    for conn in held:
+        conn.close()
+    metrics = pool.metrics()
+    assert metrics["size"] == 1 and metrics["discarded"] == 2, metrics
+    # idle connections expire down to min_size
+    pool.idle_timeout = 0
+    held = [pool.acquire(), pool.acquire()]
+    for conn in held:
+        conn.close()
+    pool.acquire().close()
+    assert pool.metrics()["size"] == 1
+    pool.close_all()
+    assert pool.metrics()["size"] == 0
+
+
+def bench_pool(threads: int = 8, requests: int = 200) -> None:
+    """requests from many threads through a connection per request
+    and through ConnectionPool, the handshake being a
+    FakeConnection one"""
+    check_pool()
+    print("{} threads, {} requests each, {:.0f} ms handshake "
+          "(requests/sec)".format(threads, requests,
+                                  FakeConnection.handshake * 1e3))
+
+    def connect_per_request():
+        conn = FakeConnection()
+        conn.query()
+        conn.close()
+
+    pool = filtered_logger.ConnectionPool(FakeConnection, min_size=2,
+                                          max_size=4)
+
+    def pooled():
+        with pool.acquire() as conn:
+            conn.query()
+
+    for name, request in (("connect per request", connect_per_request),
+                          ("pool of 2 to 4", pooled)):
+        def load():
+            for _ in range(requests):
+                request()
+        workers = [threading.Thread(target=load) for _ in range(threads)]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+        print("{:>22} {:>10.0f}".format(name, threads * requests / elapsed))
+    metrics = pool.metrics()
+    pool.close_all()
+    print("pool: {} created, {} checkouts, {} exhausted, wait max "
+          "{:.1f} ms".format(metrics["created"], metrics["checkouts"],
+                             metrics["exhausted"], metrics["wait_max"] * 1e3))
+
+
+def bench_hashing(count: int = 64, rounds: int = 10) -> None:
+    """hash_passwords and verify_many throughput
+    from 1 to cpu_count workers"""
+    cores = os.cpu_count() or 1
+    passwords = ["MyAmazingPassw0rd{}".format(i) for i in range(count)]
+    print("bcrypt, {} passwords, cost {}".format(count, rounds))
+    print("{:>10} {:>12} {:>12}".format("workers", "hashes/sec",
+                                        "checks/sec"))
+    workers = 1
+    while True:
+        start = time.perf_counter()
+        hashes = list(encrypt_password.hash_passwords(passwords, rounds,
+                                                      workers))
+        hash_rate = count / (time.perf_counter() - start)
+        start = time.perf_counter()
+        checks = list(encrypt_password.verify_many(zip(hashes, passwords),
+                                                   workers))
+        check_rate = count / (time.perf_counter() - start)
+        assert all(checks)
+        print("{:>10} {:>12.1f} {:>12.1f}".format(workers, hash_rate,
+                                                  check_rate))
+        if workers >= cores:
+            break
+        workers = min(workers * 2, cores)
+
+
+BENCHMARKS = {
+    "filter_datum": bench_filter_datum,
+    "formatter_cache": bench_formatter_cache,
+    "async_logger": bench_async_logger,
+    "export": bench_export,
+    "parallel": bench_parallel,
+    "pool": bench_pool,
+    "hashing": bench_hashing,
+}
+
+
+if __name__ == "__main__":
+    # ./benchmark.py [name ...], all of them by default
+    for name in sys.argv[1:] or BENCHMARKS:
+        BENCHMARKS[name]()
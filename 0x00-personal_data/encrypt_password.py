@@ -2,20 +2,102 @@
 """
 Defines a hash_password function to return a hashed password
 """
+import functools
+import os
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, Tuple
+
 import bcrypt
 from bcrypt import hashpw
 
+DEFAULT_ROUNDS = 12
+
+Calibration = namedtuple("Calibration", ["rounds", "budget", "timings"])
+_calibration = None
+
+
+def calibrate(budget: float = 0.25, min_rounds: int = 10,
+              max_rounds: int = 16) -> Calibration:
+    """
+    Measures bcrypt on this machine and picks the highest cost
+    whose hash stays under budget, never less than min_rounds
+    Args:
+        budget (float): per hash latency budget in seconds
+        min_rounds (int): lowest cost accepted
+        max_rounds (int): highest cost tried
+    Return:
+        Calibration with the chosen rounds and the measured
+        seconds per cost, also used by later hashes
+    """
+    global _calibration
+    timings = {}
+    rounds = min_rounds
+    for cost in range(min_rounds, max_rounds + 1):
+        start = time.perf_counter()
+        bcrypt.hashpw(b"calibration", bcrypt.gensalt(cost))
+        timings[cost] = time.perf_counter() - start
+        if timings[cost] > budget:
+            # each extra round doubles the time, stop here
+            break
+        rounds = cost
+    _calibration = Calibration(rounds, budget, timings)
+    return _calibration
+
+
+def calibration() -> Calibration:
+    """
+    Returns the last calibration, None if none ran
+    """
+    return _calibration
+
+
+def current_rounds() -> int:
+    """
+    Returns the calibrated cost, DEFAULT_ROUNDS without calibration
+    """
+    if _calibration is None:
+        return DEFAULT_ROUNDS
+    return _calibration.rounds
+
+
+def hash_rounds(hashed_password: bytes) -> int:
+    """
+    Returns the cost a bcrypt hash was made with
+    Args:
+        hashed_password (bytes): hash like b"$2b$12$..."
+    """
+    if isinstance(hashed_password, str):
+        hashed_password = hashed_password.encode()
+    return int(hashed_password.split(b"$")[2])
+
+
+def needs_rehash(hashed_password: bytes, rounds: int = None) -> bool:
+    """
+    Tells whether a hash was made with a lower cost than the
+    current one and should be replaced after a successful check.
+    Stronger hashes are kept, a calibration that picked a lower
+    cost (on a loaded machine) does not weaken them
+    Args:
+        hashed_password (bytes): stored hash
+        rounds (int): expected cost, current_rounds() by default
+    """
+    return hash_rounds(hashed_password) < (rounds or current_rounds())
+
 
-def hash_password(password: str) -> bytes:
+def hash_password(password: str, rounds: int = None) -> bytes:
     """
     Returns a hashed password
     Args:
         password (str): password to be hashed
+        rounds (int): bcrypt cost factor, current_rounds() by default
     """
     # strings must be encoded before hashing
     password = password.encode()
     # hash the password
-    hashed = bcrypt.hashpw(password, bcrypt.gensalt())
+    hashed = bcrypt.hashpw(password,
+                           bcrypt.gensalt(rounds or current_rounds()))
     return hashed
 
 
@@ -32,4 +114,79 @@ def is_valid(hashed_password: bytes, password: str) -> bool:
     password = password.encode()
     validation = bcrypt.checkpw(password, hashed_password)
     return validation
-    
+
+
+def _hash_one(rounds: int, password: str) -> bytes:
+    """worker side of hash_passwords"""
+    return hash_password(password, rounds)
+
+
+def _verify_one(pair: Tuple[bytes, str]) -> bool:
+    """worker side of verify_many"""
+    return is_valid(*pair)
+
+
+def _ordered_map(func: Callable, items: Iterable,
+                 workers: int = None, processes: bool = False) -> Iterator:
+    """
+    Runs func over items on a pool and yields the results
+    in input order as soon as they are ready
+    Args:
+        func (Callable): picklable function of one item
+        items (Iterable): inputs, consumed lazily
+        workers (int): pool size, one per core by default
+        processes (bool): use processes instead of threads
+    """
+    workers = workers or os.cpu_count() or 1
+    pool = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    with pool(max_workers=workers) as executor:
+        # a few jobs per worker in flight keeps the pool busy
+        # without reading the whole input up front
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= workers * 4:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def hash_passwords(passwords: Iterable[str],
+                   rounds: int = None,
+                   workers: int = None,
+                   processes: bool = False) -> Iterator[bytes]:
+    """
+    Hashes many passwords in parallel
+    bcrypt releases the GIL while hashing, so threads
+    already use every core
+    Args:
+        passwords (Iterable[str]): passwords to be hashed
+        rounds (int): bcrypt cost factor, current_rounds() by default
+        workers (int): pool size, one per core by default
+        processes (bool): use processes instead of threads
+    Return:
+        the hashes, in the order of passwords
+    """
+    # resolved here, worker processes do not share the calibration
+    rounds = rounds or current_rounds()
+    return _ordered_map(functools.partial(_hash_one, rounds), passwords,
+                        workers, processes)
+
+
+def verify_many(pairs: Iterable[Tuple[bytes, str]],
+                workers: int = None,
+                processes: bool = False) -> Iterator[bool]:
+    """
+    Checks many (hashed_password, password) pairs in parallel
+    Args:
+        pairs (Iterable[Tuple[bytes, str]]): pairs to check
+        workers (int): pool size, one per core by default
+        processes (bool): use processes instead of threads
+    Return:
+        is_valid for each pair, in the order of pairs
+    """
+    return _ordered_map(_verify_one, pairs, workers, processes)
+
+
+if os.getenv("BCRYPT_LATENCY_BUDGET"):
+    calibrate(float(os.getenv("BCRYPT_LATENCY_BUDGET")))
@@ -20,10 +20,23 @@
     the message is passed to the LogRecord object
     and passed to the format method."""
 
+import argparse
+import atexit
+import csv
+import functools
+import io
+import itertools
 import logging
+import logging.handlers
 import os
+import queue
 import re
-from typing import List, Tuple
+import sys
+import threading
+import time
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterable, Iterator, List, TextIO, Tuple
 
 import mysql.connector
 
@@ -44,12 +57,12 @@ def pattern_rplc(field, redaction) -> Tuple:
     return pattern, replacement
 
 
-def filter_datum(fields: List[str],
-                 redaction: str,
-                 message: str,
-                 separator: str) -> str:
-    """returns the log message obfuscated
-    with personal data protected"""
+def filter_datum_sequential(fields: List[str],
+                            redaction: str,
+                            message: str,
+                            separator: str) -> str:
+    """reference implementation of filter_datum:
+    one re.sub per field per segment"""
     new_list = splitter(message, separator)
     for field in fields:
         pattern, replacement = pattern_rplc(field, redaction)
@@ -58,6 +71,209 @@ def filter_datum(fields: List[str],
     return ";".join(new_list)
 
 
+def _single_pass_safe(fields: Tuple[str, ...], redaction: str) -> bool:
+    """checks that redacting the leftmost field of each segment
+    gives the same result as applying the fields one after another.
+    That holds for plain word fields as long as no field sits
+    inside another one (other than as its suffix) or inside
+    the redaction text"""
+    if "\\" in redaction:
+        return False
+    for field in fields:
+        if re.fullmatch(r"\w+", field) is None:
+            return False
+        if field in redaction:
+            return False
+        for other in fields:
+            if other != field and field in other \
+                    and not other.endswith(field):
+                return False
+    return True
+
+
+class Redactor:
+    """compiled redaction engine for one field set,
+    redaction and separator.
+    All the fields are folded into a single alternation regex
+    so a message is redacted in one scan instead of
+    one re.sub per field per segment"""
+
+    def __init__(self, fields: List[str], redaction: str, separator: str):
+        # duplicates do not change the output, keep the first one
+        self.fields = tuple(dict.fromkeys(fields))
+        self.redaction = redaction
+        self.separator = separator
+        self.single_pass = _single_pass_safe(self.fields, redaction)
+        self._pattern = None
+        if self.single_pass and self.fields:
+            alternation = "|".join(self.fields)
+            if separator == ";":
+                # segments end at the separator, so the whole
+                # message can be scanned at once
+                tail = "[^;\n]*"
+            else:
+                tail = ".*"
+            self._pattern = re.compile("({}){}".format(alternation, tail))
+            self._replacement = "\\g<1>=" + redaction
+
+    def redact(self, message: str) -> str:
+        """returns the message with the fields obfuscated"""
+        if not self.single_pass:
+            return filter_datum_sequential(self.fields, self.redaction,
+                                           message, self.separator)
+        if self._pattern is None:
+            return ";".join(splitter(message, self.separator))
+        if self.separator == ";":
+            return self._pattern.sub(self._replacement, message)
+        sub = self._pattern.sub
+        replacement = self._replacement
+        return ";".join(sub(replacement, val)
+                        for val in splitter(message, self.separator))
+
+    def finds_field(self, text: str) -> bool:
+        """tells whether redact could change text, always True
+        when the fields are not redacted in a single pass"""
+        if not self.single_pass:
+            return True
+        return self._pattern is not None \
+            and self._pattern.search(text) is not None
+
+
+class ColumnRedactor:
+    """redacts (columns, row) result sets without parsing
+    the formatted "k=v;" message again.
+    The PII columns are resolved once from the column names, their
+    segment becomes a constant of a format template and each row is
+    formatted with a single str.format call.
+    Rows whose values could change the regex result (a separator,
+    a newline or a field name inside a value) go through the
+    regular Redactor so the output stays byte identical"""
+
+    def __init__(self, columns: List[str],
+                 fields: List[str] = PII_FIELDS,
+                 redaction: str = "***"):
+        self.columns = tuple(columns)
+        self._redactor = Redactor(fields, redaction, ";")
+        pattern = self._redactor._pattern
+        # stripping the message happens before redaction today,
+        # so a redaction with outer spaces would behave differently
+        self.structured = self._redactor.single_pass \
+            and redaction == redaction.strip() \
+            and not any(";" in c or "\n" in c for c in self.columns)
+        segments = []
+        pii, other = [], []
+        for idx, column in enumerate(self.columns):
+            key = column.replace("{", "{{").replace("}", "}}")
+            # the leftmost field in the key decides the segment
+            match = pattern.search(column) if pattern else None
+            if match is None:
+                segments.append("{}={{{}}}".format(key, idx))
+                other.append("{{{}}}".format(idx))
+            else:
+                constant = "{}{}={}".format(column[:match.start()],
+                                            match.group(1), redaction)
+                segments.append(constant.replace("{", "{{")
+                                .replace("}", "}}"))
+                pii.append("{{{}}}".format(idx))
+        self._raw = ";".join("{}={{{}}}".format(
+            column.replace("{", "{{").replace("}", "}}"), idx)
+            for idx, column in enumerate(self.columns)).format
+        self._template = ";".join(segments).format
+        # values only matter when they hold a separator or a newline,
+        # or for non PII columns, a field name
+        self._pii_values = "\x00".join(pii).format
+        self._other_values = "\x00".join(other).format
+        if self.structured:
+            self._unsafe_pii = re.compile("[;\n]")
+            self._unsafe_other = re.compile("|".join(
+                ("[;\n]",) + self._redactor.fields))
+
+    def _is_safe(self, rows: List[Tuple]) -> bool:
+        """checks that the constant segments are exact for rows"""
+        pii = "\x00".join(self._pii_values(*row) for row in rows)
+        if self._unsafe_pii.search(pii) is not None:
+            return False
+        other = "\x00".join(self._other_values(*row) for row in rows)
+        return self._unsafe_other.search(other) is None
+
+    def format(self, row: Tuple) -> str:
+        """returns the redacted "k=v;k=v" line for row"""
+        if self.structured and self._is_safe((row,)):
+            return self._template(*row).strip()
+        return self._redactor.redact(self._raw(*row).strip())
+
+    def format_batch(self, rows: List[Tuple]) -> List[str]:
+        """format over many rows, checking them all at once"""
+        if self.structured and self._is_safe(rows):
+            template = self._template
+            return [template(*row).strip() for row in rows]
+        return [self.format(row) for row in rows]
+
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+
+class RedactorCache:
+    """process wide LRU cache of compiled redactors
+    keyed on (fields, redaction, separator).
+    Formatters with the same field set share one Redactor"""
+
+    def __init__(self, maxsize: int = 128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._redactors = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, fields: List[str],
+            redaction: str, separator: str) -> Redactor:
+        """returns the cached redactor, compiling it on a miss"""
+        key = (tuple(fields), redaction, separator)
+        with self._lock:
+            redactor = self._redactors.get(key)
+            if redactor is not None:
+                self.hits += 1
+                self._redactors.move_to_end(key)
+                return redactor
+            self.misses += 1
+        # compile outside the lock, a duplicate compile on a race is
+        # harmless since both redactors behave the same
+        redactor = Redactor(key[0], redaction, separator)
+        with self._lock:
+            self._redactors[key] = redactor
+            self._redactors.move_to_end(key)
+            while len(self._redactors) > max(self.maxsize, 0):
+                self._redactors.popitem(last=False)
+        return redactor
+
+    def info(self) -> CacheInfo:
+        """returns hit/miss counters and the cache size"""
+        with self._lock:
+            return CacheInfo(self.hits, self.misses,
+                             self.maxsize, len(self._redactors))
+
+    def clear(self) -> None:
+        """drops every redactor and resets the counters"""
+        with self._lock:
+            self._redactors.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+REDACTOR_CACHE = RedactorCache(
+    int(os.getenv("PERSONAL_DATA_REDACTOR_CACHE_SIZE", "128")))
+
+
+def filter_datum(fields: List[str],
+                 redaction: str,
+                 message: str,
+                 separator: str) -> str:
+    """returns the log message obfuscated
+    with personal data protected"""
+    redactor = REDACTOR_CACHE.get(fields, redaction, separator)
+    return redactor.redact(message)
+
+
 class RedactingFormatter(logging.Formatter):
     """ Redacting Formatter class
         """
@@ -65,13 +281,15 @@ class RedactingFormatter(logging.Formatter):
     REDACTION = "***"
     FORMAT = "[HOLBERTON] %(name)s %(levelname)s %(asctime)-15s: %(message)s"
     SEPARATOR = ";"
-    logging.basicConfig(level=logging.INFO, format=FORMAT)
 
     def __init__(self, fields: List[str]):
         super(RedactingFormatter, self).__init__(self.FORMAT)
         # call to logging.Formatter, FORMAT is passed to
         # tell logging.Formatter how records will be printed
         self.fields = fields
+        # formatters with the same fields share one compiled redactor
+        self._redactor = REDACTOR_CACHE.get(fields, self.REDACTION,
+                                            self.SEPARATOR)
 
     def format(self, record: logging.LogRecord) -> str:
         """returns a formatted and filtered record/message
@@ -88,15 +306,88 @@ class RedactingFormatter(logging.Formatter):
         message: str = super().format(record)
         # filter the returned record using the custom
         # desired format
-        filtered_message: str = filter_datum(self.fields,
-                                             self.REDACTION,
-                                             message,
-                                             self.SEPARATOR)
+        if getattr(record, "redacted", False) \
+                and message.endswith(record.message):
+            # logged with extra={"redacted": True}: the message was
+            # redacted with these fields already (see ColumnRedactor),
+            # only the prefix added by FORMAT is left to check
+            prefix = message[:len(message) - len(record.message)]
+            if not self._redactor.finds_field(prefix):
+                return message
+        filtered_message: str = self._redactor.redact(message)
         return filtered_message
 
 
-def get_logger() -> logging.Logger:
-    """gets logger object"""
+logging.basicConfig(level=logging.INFO, format=RedactingFormatter.FORMAT)
+
+
+OVERFLOW_POLICIES = ("block", "drop_oldest", "drop_newest")
+_listeners: List[logging.handlers.QueueListener] = []
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler over a bounded queue.
+    Raw records are queued so formatting and redaction
+    happen on the listener thread, and overflow follows
+    one of OVERFLOW_POLICIES"""
+
+    def __init__(self, log_queue: queue.Queue, overflow: str = "block"):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError("overflow must be one of {}".format(
+                ", ".join(OVERFLOW_POLICIES)))
+        super().__init__(log_queue)
+        self.overflow = overflow
+        self.dropped = 0
+        self.listener = None
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """leaves the record untouched, the listener formats it"""
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        """puts the record on the queue following the overflow policy"""
+        if self.overflow == "block":
+            self.queue.put(record)
+            return
+        while True:
+            try:
+                self.queue.put_nowait(record)
+                return
+            except queue.Full:
+                self.dropped += 1
+                if self.overflow == "drop_newest":
+                    return
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                pass
+
+
+class _FlushingQueueListener(logging.handlers.QueueListener):
+    """QueueListener whose stop sentinel waits for room
+    in a full queue instead of raising"""
+
+    def enqueue_sentinel(self) -> None:
+        """blocks until the sentinel fits, the thread is draining"""
+        self.queue.put(self._sentinel)
+
+
+def flush_loggers() -> None:
+    """stops every async listener once the queued records
+    have been written"""
+    while _listeners:
+        _listeners.pop().stop()
+
+
+atexit.register(flush_loggers)
+
+
+def get_logger(async_: bool = False,
+               queue_size: int = 10000,
+               overflow: str = "block") -> logging.Logger:
+    """gets logger object
+    with async_ the caller only queues the record,
+    a listener thread does the redaction and the write"""
     this_logger = logging.Logger("user_data", level=logging.INFO)
     this_logger.propagate = False
 
@@ -105,32 +396,533 @@ def get_logger() -> logging.Logger:
     # use RedactingFormatter as format
     log_formatter = RedactingFormatter(PII_FIELDS)
     stream_handler.setFormatter(log_formatter)
-    # add the stream handler as a handler for this logger
-    this_logger.addHandler(stream_handler)
+    if not async_:
+        # add the stream handler as a handler for this logger
+        this_logger.addHandler(stream_handler)
+        return this_logger
+
+    # the stream handler now runs on the listener thread
+    queue_handler = BoundedQueueHandler(queue.Queue(queue_size), overflow)
+    listener = _FlushingQueueListener(queue_handler.queue, stream_handler,
+                                      respect_handler_level=True)
+    queue_handler.listener = listener
+    listener.start()
+    _listeners.append(listener)
+    this_logger.addHandler(queue_handler)
     return this_logger
 
 
+class PooledConnection:
+    """connection checked out of a ConnectionPool,
+    close() hands it back to the pool instead of closing it"""
+
+    def __init__(self, pool: "ConnectionPool", conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name: str):
+        return getattr(self._conn, name)
+
+    def close(self) -> None:
+        """returns the connection to its pool"""
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.release(conn)
+
+    def __enter__(self) -> "PooledConnection":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class ConnectionPool:
+    """bounded pool of database connections.
+    - min_size connections are opened up front and kept
+    - at most max_size connections exist at once, a checkout past
+      that waits up to checkout_timeout seconds
+    - connections idle for more than idle_timeout seconds are
+      closed, down to min_size
+    - connections are health checked when checked out"""
+
+    def __init__(self, connect: Callable, min_size: int = 1,
+                 max_size: int = 10, idle_timeout: float = 300.0,
+                 checkout_timeout: float = 30.0):
+        if max_size < 1 or min_size < 0 or min_size > max_size:
+            raise ValueError("need 0 <= min_size <= max_size, 1 <= max_size")
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.checkout_timeout = checkout_timeout
+        self._idle = deque()
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._checkouts = 0
+        self._created = 0
+        self._discarded = 0
+        self._exhausted = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        for _ in range(min_size):
+            self._idle.append((self._open(), time.monotonic()))
+            self._size += 1
+
+    def _open(self):
+        """opens a new connection"""
+        conn = self._connect()
+        with self._cond:
+            self._created += 1
+        return conn
+
+    @staticmethod
+    def _healthy(conn) -> bool:
+        """checks the connection is still usable"""
+        try:
+            if hasattr(conn, "is_connected"):
+                return bool(conn.is_connected())
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close(conn) -> None:
+        """closes a connection, ignoring errors of dead ones"""
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _expire_idle(self) -> list:
+        """pops idle connections past idle_timeout, oldest first,
+        never going under min_size. The caller closes them"""
+        expired = []
+        limit = time.monotonic() - self.idle_timeout
+        while self._idle and self._size > self.min_size \
+                and self._idle[0][1] < limit:
+            expired.append(self._idle.popleft()[0])
+            self._size -= 1
+        return expired
+
+    def acquire(self) -> PooledConnection:
+        """checks a healthy connection out of the pool"""
+        start = time.monotonic()
+        deadline = start + self.checkout_timeout
+        waited = False
+        while True:
+            conn = None
+            create = False
+            with self._cond:
+                if self._closed:
+                    raise RuntimeError("connection pool is closed")
+                expired = self._expire_idle()
+                while conn is None and not create:
+                    if self._idle:
+                        # most recently used first, it is the warmest
+                        conn = self._idle.pop()[0]
+                    elif self._size < self.max_size:
+                        self._size += 1
+                        create = True
+                    else:
+                        if not waited:
+                            self._exhausted += 1
+                            waited = True
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0 or \
+                                not self._cond.wait(remaining):
+                            if not self._idle and \
+                                    self._size >= self.max_size:
+                                raise TimeoutError(
+                                    "connection pool exhausted")
+            for old in expired:
+                self._close(old)
+            if create:
+                try:
+                    conn = self._open()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+            elif not self._healthy(conn):
+                self._close(conn)
+                with self._cond:
+                    self._size -= 1
+                    self._discarded += 1
+                    self._cond.notify()
+                continue
+            waited_for = time.monotonic() - start
+            with self._cond:
+                self._checkouts += 1
+                self._wait_total += waited_for
+                self._wait_max = max(self._wait_max, waited_for)
+            return PooledConnection(self, conn)
+
+    @staticmethod
+    def _reset(conn) -> bool:
+        """rolls back what the last borrower left open: its
+        transaction, read snapshot and unread results.
+        Returns False when the connection could not be reset"""
+        try:
+            if hasattr(conn, "rollback"):
+                conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def release(self, conn) -> None:
+        """puts a connection back for the next checkout,
+        once reset. One that cannot be reset is closed"""
+        if not self._closed and not self._reset(conn):
+            self._close(conn)
+            with self._cond:
+                self._size -= 1
+                self._discarded += 1
+                self._cond.notify()
+            return
+        with self._cond:
+            if not self._closed:
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+                return
+            self._size -= 1
+        self._close(conn)
+
+    def close_all(self) -> None:
+        """closes the idle connections,
+        checked out ones are closed when released afterwards"""
+        with self._cond:
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+            self._closed = True
+            self._cond.notify_all()
+        for conn in idle:
+            self._close(conn)
+
+    def metrics(self) -> dict:
+        """returns pool size and checkout statistics"""
+        with self._cond:
+            return {"size": self._size,
+                    "idle": len(self._idle),
+                    "in_use": self._size - len(self._idle),
+                    "checkouts": self._checkouts,
+                    "created": self._created,
+                    "discarded": self._discarded,
+                    "exhausted": self._exhausted,
+                    "wait_total": self._wait_total,
+                    "wait_max": self._wait_max}
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """returns the process wide pool, built from the
+    environment on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            connect = functools.partial(
+                mysql.connector.connect,
+                host=os.getenv("PERSONAL_DATA_DB_HOST", "localhost"),
+                database=os.getenv("PERSONAL_DATA_DB_NAME"),
+                user=os.getenv("PERSONAL_DATA_DB_USERNAME", "root"),
+                password=os.getenv("PERSONAL_DATA_DB_PASSWORD", "root"))
+            _pool = ConnectionPool(
+                connect,
+                min_size=int(os.getenv("PERSONAL_DATA_DB_POOL_MIN", "1")),
+                max_size=int(os.getenv("PERSONAL_DATA_DB_POOL_MAX", "10")),
+                idle_timeout=float(os.getenv(
+                    "PERSONAL_DATA_DB_POOL_IDLE_TIMEOUT", "300")))
+        return _pool
+
+
 def get_db() -> mysql.connector.connection.MySQLConnection:
-    """gets database"""
-    username = os.getenv("PERSONAL_DATA_DB_USERNAME", "root")
-    password = os.getenv("PERSONAL_DATA_DB_PASSWORD", "root")
-    db_host = os.getenv("PERSONAL_DATA_DB_HOST", "localhost")
-    data_base = os.getenv("PERSONAL_DATA_DB_NAME")
-    conn = mysql.connector.connect(host=db_host,
-                                   database=data_base,
-                                   user=username,
-                                   password=password)
-    return conn
-
-
-def main() -> None:
-    """main function"""
+    """gets database
+    the connection comes from the pool, close() returns it"""
+    return get_pool().acquire()
+
+
+def _open_cursor(db):
+    """returns an unbuffered cursor so rows stream from the server
+    instead of being read into memory up front.
+    DB-API connections without the buffered option (e.g. sqlite3)
+    get their default cursor"""
+    try:
+        return db.cursor(buffered=False)
+    except TypeError:
+        return db.cursor()
+
+
+def export_users(db, out: TextIO,
+                 batch_size: int = 1000,
+                 fields: List[str] = PII_FIELDS) -> Tuple[int, float]:
+    """streams the users table into out, one redacted row per line.
+    Rows are pulled with fetchmany(batch_size), redacted column-wise
+    and each batch is written in a single call.
+    Returns the number of rows and the seconds spent"""
+    start = time.perf_counter()
+    cursor = _open_cursor(db)
+    rows = 0
+    try:
+        cursor.execute("SELECT * FROM users;")
+        # PII columns are resolved once for the whole result set
+        redactor = ColumnRedactor([column[0]
+                                   for column in cursor.description],
+                                  fields, RedactingFormatter.REDACTION)
+        while True:
+            batch = cursor.fetchmany(batch_size)
+            if not batch:
+                break
+            out.write("\n".join(redactor.format_batch(batch)))
+            out.write("\n")
+            rows += len(batch)
+    finally:
+        cursor.close()
+    return rows, time.perf_counter() - start
+
+
+def _redact_chunk(fields: Tuple[str, ...], redaction: str,
+                  separator: str, chunk: str) -> str:
+    """worker side of parallel_redact, the redactor is
+    compiled once per process through the cache"""
+    return REDACTOR_CACHE.get(fields, redaction, separator).redact(chunk)
+
+
+@functools.lru_cache(maxsize=16)
+def _column_redactor(columns: Tuple[str, ...], fields: Tuple[str, ...],
+                     redaction: str) -> ColumnRedactor:
+    """ColumnRedactor compiled once per process and column set"""
+    return ColumnRedactor(columns, fields, redaction)
+
+
+def _redact_rows(columns: Tuple[str, ...], fields: Tuple[str, ...],
+                 redaction: str, rows: List[Tuple]) -> str:
+    """worker side of parallel_export_users: rows as redacted
+    "k=v;k=v" lines, like export_users writes them"""
+    redactor = _column_redactor(columns, fields, redaction)
+    return "".join(line + "\n" for line in redactor.format_batch(rows))
+
+
+def _redact_csv_chunk(columns: Tuple[str, ...], fields: Tuple[str, ...],
+                      redaction: str, chunk: str) -> str:
+    """worker side of parallel_redact_csv, parses the records
+    of chunk and redacts them like the rows of a result set"""
+    rows = [row for row in csv.reader(io.StringIO(chunk, newline=""))
+            if row]
+    for row in rows:
+        if len(row) != len(columns):
+            raise ValueError("CSV record of {} values, the header has "
+                             "{}".format(len(row), len(columns)))
+    return _redact_rows(columns, fields, redaction, rows)
+
+
+def _chunks(lines: Iterable[str],
+            chunk_lines: int) -> Iterator[Tuple[int, str]]:
+    """groups lines into chunk_lines sized blocks of text,
+    yields the line count with each block"""
+    lines = iter(lines)
+    while True:
+        block = list(itertools.islice(lines, chunk_lines))
+        if not block:
+            return
+        yield len(block), "".join(block)
+
+
+def _csv_chunks(lines: Iterable[str],
+                chunk_rows: int) -> Iterator[Tuple[int, str]]:
+    """groups CSV lines into blocks of about chunk_rows records,
+    a block only ends where no quoted value is open.
+    Yields the record count with each block"""
+    block = []
+    rows = 0
+    quoted = False
+    for line in lines:
+        block.append(line)
+        # an escaped quote ("") toggles twice
+        if line.count('"') % 2:
+            quoted = not quoted
+        if not quoted:
+            if line.strip():
+                rows += 1
+            if rows >= chunk_rows:
+                yield rows, "".join(block)
+                block = []
+                rows = 0
+    if block:
+        yield rows, "".join(block)
+
+
+def _map_ordered(job: Callable, chunks: Iterable[Tuple[int, object]],
+                 out: TextIO, workers: int = None) -> int:
+    """runs job over the (count, chunk) pairs of chunks on a process
+    pool and writes the results to out in their original order.
+    At most two chunks per worker are in flight so memory stays
+    flat whatever the input size. Returns the sum of the counts"""
+    workers = workers or os.cpu_count() or 1
+    count = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for size, chunk in chunks:
+            pending.append(executor.submit(job, chunk))
+            count += size
+            if len(pending) >= workers * 2:
+                out.write(pending.popleft().result())
+        while pending:
+            out.write(pending.popleft().result())
+    return count
+
+
+def parallel_redact(lines: Iterable[str], out: TextIO,
+                    fields: List[str] = PII_FIELDS,
+                    separator: str = RedactingFormatter.SEPARATOR,
+                    workers: int = None,
+                    chunk_lines: int = 10000) -> int:
+    """redacts newline terminated "k=v;k=v" lines over a process pool
+    and writes them to out in their original order.
+    Returns the number of lines"""
+    job = functools.partial(_redact_chunk, tuple(fields),
+                            RedactingFormatter.REDACTION, separator)
+    return _map_ordered(job, _chunks(lines, chunk_lines), out, workers)
+
+
+def parallel_redact_csv(columns: List[str], lines: Iterable[str],
+                        out: TextIO, fields: List[str] = PII_FIELDS,
+                        workers: int = None,
+                        chunk_lines: int = 10000) -> int:
+    """redacts the CSV records of lines, whose values are named by
+    columns, over a process pool. Each record is written as a
+    redacted "k=v;k=v" line, as export_users does with the rows of
+    the users table, in the original order.
+    Returns the number of records"""
+    job = functools.partial(_redact_csv_chunk, tuple(columns),
+                            tuple(fields), RedactingFormatter.REDACTION)
+    return _map_ordered(job, _csv_chunks(lines, chunk_lines), out, workers)
+
+
+def parallel_export_users(db, out: TextIO,
+                          batch_size: int = 1000,
+                          fields: List[str] = PII_FIELDS,
+                          workers: int = None) -> Tuple[int, float]:
+    """export_users with the batches redacted over a process pool,
+    written in their original order.
+    Returns the number of rows and the seconds spent"""
+    start = time.perf_counter()
+    cursor = _open_cursor(db)
+    try:
+        cursor.execute("SELECT * FROM users;")
+        job = functools.partial(
+            _redact_rows, tuple(column[0] for column in cursor.description),
+            tuple(fields), RedactingFormatter.REDACTION)
+        batches = iter(lambda: cursor.fetchmany(batch_size), [])
+        rows = _map_ordered(job, ((len(batch), batch) for batch in batches),
+                            out, workers)
+    finally:
+        cursor.close()
+    return rows, time.perf_counter() - start
+
+
+INPUT_FORMATS = ("auto", "csv", "kv")
+
+
+def redact_file(in_path: str, out: TextIO, input_format: str = "auto",
+                **kwargs) -> Tuple[int, float]:
+    """redacts every record of in_path over a process pool
+    - input_format: "csv" for a CSV file with its column names on
+      the first line (like user_data.csv), "kv" for "k=v;k=v" lines,
+      "auto" picks "kv" when the first line holds a "="
+    Returns the number of records and the seconds spent"""
+    if input_format not in INPUT_FORMATS:
+        raise ValueError("input_format must be one of {}".format(
+            ", ".join(INPUT_FORMATS)))
+    start = time.perf_counter()
+    with open(in_path, "r", newline="") as src:
+        first = src.readline()
+        if input_format == "auto":
+            input_format = "kv" if "=" in first else "csv"
+        if input_format == "kv":
+            count = parallel_redact(itertools.chain([first], src), out,
+                                    **kwargs)
+        else:
+            columns = next(csv.reader([first]), [])
+            if not columns:
+                raise ValueError("{} has no CSV header".format(in_path))
+            count = parallel_redact_csv(columns, src, out, **kwargs)
+    return count, time.perf_counter() - start
+
+
+def main(argv: List[str] = None) -> None:
+    """main function
+    without arguments every row is logged through get_logger,
+    --export streams the redacted rows to a file or stdout"""
+    parser = argparse.ArgumentParser(description="redacted users dump")
+    parser.add_argument("--export", nargs="?", const="-", default=None,
+                        metavar="PATH",
+                        help="stream redacted rows to PATH (default stdout)")
+    parser.add_argument("--batch-size", type=int, default=1000,
+                        help="rows fetched per round trip")
+    parser.add_argument("--input", default=None, metavar="FILE",
+                        help="redact FILE instead of the "
+                             "users table, written to --export")
+    parser.add_argument("--format", choices=INPUT_FORMATS, default="auto",
+                        help="layout of --input: CSV with a header "
+                             "or k=v lines (default: guessed)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="processes used with --input, and with "
+                             "--export when given (default: one per "
+                             "core with --input)")
+    parser.add_argument("--chunk-lines", type=int, default=10000,
+                        help="records handed to a worker at a time")
+    args = parser.parse_args(argv)
+
+    if args.input is not None:
+        path = args.export or "-"
+        kwargs = {"input_format": args.format, "workers": args.workers,
+                  "chunk_lines": args.chunk_lines}
+        if path == "-":
+            rows, seconds = redact_file(args.input, sys.stdout, **kwargs)
+        else:
+            with open(path, "w", newline="") as out:
+                rows, seconds = redact_file(args.input, out, **kwargs)
+        print("redacted {} records in {:.2f}s ({:.0f} records/sec)".format(
+            rows, seconds, rows / seconds if seconds else 0),
+            file=sys.stderr)
+        return
+
     db = get_db()
+    if args.export is not None:
+        export = export_users
+        if args.workers is not None:
+            # batches redacted over a process pool
+            export = functools.partial(parallel_export_users,
+                                       workers=args.workers)
+        try:
+            if args.export == "-":
+                rows, seconds = export(db, sys.stdout, args.batch_size)
+            else:
+                with open(args.export, "w") as out:
+                    rows, seconds = export(db, out, args.batch_size)
+        finally:
+            db.close()
+        print("exported {} rows in {:.2f}s ({:.0f} rows/sec)".format(
+            rows, seconds, rows / seconds if seconds else 0),
+            file=sys.stderr)
+        return
+
     logger = get_logger()
     cursor = db.cursor()
     cursor.execute("SELECT * FROM users;")
     fields = cursor.column_names
+    # rows are redacted column-wise, the formatter skips its regex
+    redactor = ColumnRedactor(fields, PII_FIELDS,
+                              RedactingFormatter.REDACTION)
     for row in cursor:
+        if redactor.structured:
+            logger.info(redactor.format(row), extra={"redacted": True})
+            continue
         message = ";".join("{}={}".format(k, v) for k, v in zip(fields, row))
         message = message.strip()
         logger.info(message)
@@ -2,18 +2,144 @@
 """ Module of Users views
 """
 from api.v1.views import app_views
-from flask import abort, jsonify, request
+from datetime import datetime
+from flask import Response, abort, jsonify, request, stream_with_context
+from itertools import islice
+from typing import Iterable, Iterator
+from urllib.parse import urlencode
 from models.user import User
+import hashlib
+import json
+
+
+MAX_PAGE_SIZE = 1000
+# users encoded per chunk of a streamed response
+STREAM_BATCH = 1000
+STREAM_FORMATS = {"ndjson": "application/x-ndjson",
+                  "json": "application/json"}
+# query parameters filtering the listing, looked up by User.search
+FILTER_ATTRIBUTES = ("email", "first_name")
+
+
+def _etag(version: str) -> str:
+    """ Entity tag of a resource version
+    """
+    return hashlib.md5(version.encode()).hexdigest()
+
+
+def _conditional(etag: str, last_modified: datetime) -> Response:
+    """ 304 response when the copy of the client is current,
+    None when the resource has to be sent
+    - last_modified: naive UTC datetime of the last change
+    Only If-None-Match is checked: If-Modified-Since has whole
+    seconds, a change in the same second as the copy would be missed
+    """
+    if not request.if_none_match or \
+            not request.if_none_match.contains_weak(etag):
+        return None
+    return _validators(Response(status=304), etag, last_modified)
+
+
+def _validators(response: Response, etag: str,
+                last_modified: datetime) -> Response:
+    """ Set ETag and Last-Modified on a response
+    """
+    response.set_etag(etag)
+    response.last_modified = last_modified.replace(microsecond=0)
+    return response
+
+
+def _stream_users(users: Iterable[User], stream: str,
+                  fields: list = None) -> Iterator[str]:
+    """ Chunks of a streamed list of users: one JSON object per
+    line for "ndjson", a JSON array for "json"
+    """
+    first = True
+    while True:
+        chunk = [json.dumps(user.to_json(fields=fields))
+                 for user in islice(users, STREAM_BATCH)]
+        if not chunk:
+            break
+        if stream == "ndjson":
+            yield "\n".join(chunk) + "\n"
+        else:
+            yield ("[" if first else ",") + ",".join(chunk)
+        first = False
+    if stream == "json":
+        yield "[]" if first else "]"
 
 
 @app_views.route('/users', methods=['GET'], strict_slashes=False)
 def view_all_users() -> str:
     """ GET /api/v1/users
+    Query parameters (optional):
+      - limit: page size, at most MAX_PAGE_SIZE
+      - after: id of the last User of the previous page
+      - stream: "ndjson" or "json", streams every User after `after`
+        (up to `limit` if given) in chunks
+      - fields: comma separated attributes to return, all by default
+        or when empty
+      - email, first_name: only the Users with this value
     Return:
       - list of all User objects JSON represented
+      - with limit or after, one page of Users ordered by id, and
+        a Link header to the next page
+      - 304 if the If-None-Match copy is current
+      - 400 if a parameter is invalid
     """
-    all_users = [user.to_json() for user in User.all()]
-    return jsonify(all_users)
+    limit = request.args.get("limit")
+    after = request.args.get("after")
+    stream = request.args.get("stream")
+    fields = request.args.get("fields")
+    if fields is not None:
+        # fields= (empty) returns all of them, like no fields
+        fields = [field for field in fields.split(",") if field] or None
+    if fields is not None:
+        unknown = set(fields) - set(User.json_fields())
+        if unknown:
+            return jsonify({'error': "unknown fields: {}".format(
+                ", ".join(sorted(unknown)))}), 400
+    attributes = {attr: request.args.get(attr) for attr in FILTER_ATTRIBUTES
+                  if request.args.get(attr) is not None}
+    if stream is not None and stream not in STREAM_FORMATS:
+        return jsonify({'error': "stream must be one of {}".format(
+            ", ".join(STREAM_FORMATS))}), 400
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            limit = 0
+        if limit < 1 or (stream is None and limit > MAX_PAGE_SIZE):
+            return jsonify({'error': "limit must be between 1 and {}".format(
+                MAX_PAGE_SIZE)}), 400
+    version, last_modified = User.collection_version()
+    last_modified = last_modified or datetime.utcnow()
+    # the body depends on the query parameters too
+    etag = _etag("{}?{}".format(version, urlencode(
+        sorted(request.args.items()))))
+    response = _conditional(etag, last_modified)
+    if response is not None:
+        return response
+    if stream is not None:
+        users = User.iter_ordered(after, STREAM_BATCH, attributes)
+        if limit is not None:
+            users = islice(users, limit)
+        response = Response(
+            stream_with_context(_stream_users(users, stream, fields)),
+            mimetype=STREAM_FORMATS[stream])
+        return _validators(response, etag, last_modified)
+    if limit is None and after is None:
+        all_users = [user.to_json(fields=fields)
+                     for user in User.search(attributes)]
+        return _validators(jsonify(all_users), etag, last_modified)
+    limit = limit or MAX_PAGE_SIZE
+    users = User.page(limit, after, attributes)
+    response = jsonify([user.to_json(fields=fields) for user in users])
+    if len(users) == limit:
+        query = dict(request.args, limit=limit, after=users[-1].id)
+        response.headers["Link"] = '<{}?{}>; rel="next"'.format(
+            request.base_url, urlencode(query))
+    return _validators(response, etag, last_modified)
 
 
 @app_views.route('/users/<user_id>', methods=['GET'], strict_slashes=False)
@@ -23,6 +149,7 @@ def view_one_user(user_id: str = None) -> str:
       - User ID
     Return:
       - User object JSON represented
+      - 304 if the If-None-Match copy is current
       - 404 if the User ID doesn't exist
     """
     if user_id is None:
@@ -30,7 +157,11 @@ def view_one_user(user_id: str = None) -> str:
     user = User.get(user_id)
     if user is None:
         abort(404)
-    return jsonify(user.to_json())
+    etag = _etag(user.etag())
+    response = _conditional(etag, user.updated_at)
+    if response is not None:
+        return response
+    return _validators(jsonify(user.to_json()), etag, user.updated_at)
 
 
 @app_views.route('/users/<user_id>', methods=['DELETE'], strict_slashes=False)
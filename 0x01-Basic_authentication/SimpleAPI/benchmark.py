@@ -0,0 +1,414 @@
+#!/usr/bin/env python3
+""" Benchmarks of the API
+Run from this directory once the api/ tree of the project
+is copied over it:
+    $ python3 benchmark.py [name ...]
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def bench_require_auth(patterns: int = 10000, lookups: int = 20000) -> None:
+    """ Auth.require_auth with a list against a PathMatcher
+    """
+    from api.v1.auth.auth import Auth, PathMatcher
+    excluded = ["/api/v1/excluded_{}/".format(i) for i in range(patterns)]
+    excluded += ["/api/v1/prefix_{}*".format(i) for i in range(patterns)]
+    excluded += ["/api/v1/stat*"]
+    paths = ["/api/v1/users", "/api/v1/stats", "/api/v1/prefix_42/x",
+             "/api/v1/excluded_9999"]
+    auth = Auth()
+    matcher = PathMatcher(excluded)
+    print("require_auth, {} excluded paths (lookups/sec)".format(
+        len(excluded)))
+
+    start = time.perf_counter()
+    for i in range(lookups // 100):
+        auth.require_auth(paths[i % len(paths)], excluded)
+    elapsed = time.perf_counter() - start
+    print("{:>22} {:>12.0f}".format("list", lookups // 100 / elapsed))
+
+    start = time.perf_counter()
+    for i in range(lookups):
+        auth.require_auth(paths[i % len(paths)], matcher)
+    elapsed = time.perf_counter() - start
+    print("{:>22} {:>12.0f}".format("PathMatcher", lookups / elapsed))
+
+
+def make_users(count: int) -> list:
+    """ Fill the User store with count users, without touching the file
+    """
+    from models.base import DATA
+    from models.user import User
+    DATA['User'] = {}
+    users = []
+    for i in range(count):
+        user = User(email="user{}@example.com".format(i),
+                    first_name="First{}".format(i % 1000),
+                    last_name="Last{}".format(i))
+        DATA['User'][user.id] = user
+        users.append(user)
+    User.rebuild_indexes()
+    return users
+
+
+def bench_search(count: int = 1000000, lookups: int = 20) -> None:
+    """ User.search by email through the index against a scan
+    """
+    from models.user import User
+    make_users(count)
+    emails = ["user{}@example.com".format(i * (count // lookups))
+              for i in range(lookups)]
+    print("User.search by email, {} users (lookups/sec)".format(count))
+
+    start = time.perf_counter()
+    for email in emails:
+        assert len(User._scan({"email": email})) == 1
+    elapsed = time.perf_counter() - start
+    print("{:>22} {:>12.1f}".format("scan", lookups / elapsed))
+
+    start = time.perf_counter()
+    for _ in range(1000):
+        for email in emails:
+            assert len(User.search({"email": email})) == 1
+    elapsed = time.perf_counter() - start
+    print("{:>22} {:>12.1f}".format("index", lookups * 1000 / elapsed))
+
+
+def bench_save(count: int = 20000, saves: int = 50) -> None:
+    """ User.save with file storage against journal storage
+    """
+    import models.base
+    print("User.save with {} users (saves/sec)".format(count))
+    cwd = os.getcwd()
+    storage = models.base.STORAGE
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            for name in ("file", "journal"):
+                models.base.STORAGE = name
+                users = make_users(count)
+                start = time.perf_counter()
+                for user in users[:saves]:
+                    user.first_name = "Renamed"
+                    user.save()
+                elapsed = time.perf_counter() - start
+                print("{:>22} {:>12.1f}".format(name, saves / elapsed))
+        finally:
+            models.base.STORAGE = storage
+            os.chdir(cwd)
+
+
+def bench_group_commit(count: int = 5000, threads: int = 8,
+                       saves: int = 25) -> None:
+    """ Concurrent User.save load, one flush per save against
+    group commit, for both storages
+    """
+    import threading
+    import models.base
+    from models.group_commit import COMMITTERS, stop_all
+    print("{} threads x {} saves, {} users (saves/sec)".format(
+        threads, saves, count))
+    cwd = os.getcwd()
+    settings = (models.base.STORAGE, models.base.GROUP_COMMIT_INTERVAL)
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            for storage in ("file", "journal"):
+                for interval in (0, 0.05):
+                    models.base.STORAGE = storage
+                    models.base.GROUP_COMMIT_INTERVAL = interval
+                    users = make_users(count)
+
+                    def load(offset):
+                        for user in users[offset::threads][:saves]:
+                            user.first_name = "Renamed"
+                            user.save()
+
+                    workers = [threading.Thread(target=load, args=(i,))
+                               for i in range(threads)]
+                    start = time.perf_counter()
+                    for worker in workers:
+                        worker.start()
+                    for worker in workers:
+                        worker.join()
+                    elapsed = time.perf_counter() - start
+                    # the last flush belongs to the load
+                    metrics = None
+                    if 'User' in COMMITTERS:
+                        COMMITTERS['User'].flush()
+                        metrics = COMMITTERS['User'].metrics()
+                        elapsed = time.perf_counter() - start
+                    stop_all()
+                    name = storage + (" group commit" if interval else "")
+                    print("{:>22} {:>12.1f}  {}".format(
+                        name, threads * saves / elapsed,
+                        "" if metrics is None else
+                        "{:.1f} writes/flush".format(
+                            metrics["writes_per_flush"])))
+        finally:
+            models.base.STORAGE, models.base.GROUP_COMMIT_INTERVAL = settings
+            os.chdir(cwd)
+
+
+def make_snapshot(count: int) -> None:
+    """ Write a .db_User.json of count users in the current directory
+    """
+    import json
+    from models.snapshot import write_snapshot
+    record = ('{{"id": "{0}", "created_at": "2024-01-01T00:00:00", '
+              '"updated_at": "2024-01-01T00:00:00", '
+              '"email": "user{1}@example.com", "_password": null, '
+              '"first_name": "First{1}", "last_name": "Last{1}"}}')
+    write_snapshot(".db_User.json", (
+        ("id-{}".format(i), record.format("id-{}".format(i), i))
+        for i in range(count)))
+    assert json.load(open(".db_User.json"))["id-1"]["email"] == \
+        "user1@example.com"
+
+
+def bench_startup(count: int = 1000000) -> None:
+    """ Cold start with count stored users, eager against lazy load,
+    up to a first search by email. The app is imported when Flask is
+    installed, else only the users are loaded
+    """
+    try:
+        import flask  # noqa: F401
+        code = "import api.v1.app"
+    except ImportError:
+        code = "from models.user import User; User.load_from_file()"
+    # one lookup by id and one search by email, as BasicAuth does
+    code += ("; from models.user import User; User.get('id-1').email"
+             "; assert User.search({'email': 'user2@example.com'})")
+    print("startup with {} users (seconds)".format(count))
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            make_snapshot(count)
+            for name, lazy in (("eager", "0"), ("lazy", "1")):
+                env = dict(os.environ, MODELS_LAZY_LOAD=lazy,
+                           PYTHONPATH=os.pathsep.join(
+                               [cwd] + sys.path[1:]))
+                start = time.perf_counter()
+                subprocess.run([sys.executable, "-c", code], env=env,
+                               check=True)
+                elapsed = time.perf_counter() - start
+                print("{:>22} {:>12.2f}".format(name, elapsed))
+        finally:
+            os.chdir(cwd)
+
+
+def stress_store(count: int = 2000, threads: int = 8,
+                 ops: int = 200) -> None:
+    """ Hammer the User store from many threads, saving, removing
+    and reading concurrently, then check that memory, indexes and
+    the storage agree
+    """
+    import random
+    import threading
+    import models.base
+    from models.base import DATA
+    from models.group_commit import stop_all
+    from models.journal import JOURNALS
+    from models.user import User
+    print("{} threads x {} ops, {} users".format(threads, ops, count))
+    cwd = os.getcwd()
+    settings = (models.base.STORAGE, models.base.GROUP_COMMIT_INTERVAL)
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            for storage, interval in (("file", 0), ("journal", 0),
+                                      ("journal", 0.01)):
+                models.base.STORAGE = storage
+                models.base.GROUP_COMMIT_INTERVAL = interval
+                users = make_users(count)
+                User.save_to_file()
+                errors = []
+                expected = {user.id: user.email for user in users}
+                expected_lock = threading.Lock()
+
+                def load(seed):
+                    rand = random.Random(seed)
+                    mine = users[seed::threads]
+                    try:
+                        for i in range(ops):
+                            action = rand.random()
+                            if action < 0.3:
+                                user = User(email="new{}-{}@example.com"
+                                            .format(seed, i))
+                                user.save()
+                                mine.append(user)
+                                with expected_lock:
+                                    expected[user.id] = user.email
+                            elif action < 0.5 and mine:
+                                user = mine.pop(rand.randrange(len(mine)))
+                                user.remove()
+                                with expected_lock:
+                                    del expected[user.id]
+                            elif action < 0.7 and mine:
+                                user = rand.choice(mine)
+                                user.email = "moved{}-{}@example.com".format(
+                                    seed, i)
+                                user.save()
+                                with expected_lock:
+                                    expected[user.id] = user.email
+                            elif action < 0.9 and mine:
+                                user = rand.choice(mine)
+                                assert User.search(
+                                    {"email": user.email}) == [user]
+                                assert User.get(user.id) is user
+                            else:
+                                User.count()
+                                len(User.all())
+                    except Exception as e:
+                        errors.append(e)
+
+                workers = [threading.Thread(target=load, args=(i,))
+                           for i in range(threads)]
+                start = time.perf_counter()
+                for worker in workers:
+                    worker.start()
+                for worker in workers:
+                    worker.join()
+                elapsed = time.perf_counter() - start
+                stop_all()
+                for journal in JOURNALS.values():
+                    journal.wait()
+                    journal.close()
+                name = storage + (" group commit" if interval else "")
+                assert not errors, "{}: {!r}".format(name, errors[0])
+                in_memory = {obj_id: user.email
+                             for obj_id, user in DATA['User'].items()}
+                assert in_memory == expected, name
+                for obj_id, email in expected.items():
+                    assert [u.id for u in User.search({"email": email})] \
+                        == [obj_id], name
+                User.load_from_file()
+                on_disk = {obj_id: user.email
+                           for obj_id, user in DATA['User'].items()}
+                assert on_disk == expected, name
+                print("{:>22} {:>12.1f} ops/sec, consistent".format(
+                    name, threads * ops / elapsed))
+        finally:
+            models.base.STORAGE, models.base.GROUP_COMMIT_INTERVAL = settings
+            os.chdir(cwd)
+
+
+def bench_memory(count: int = 1000000) -> None:
+    """ Memory held by the User store, in bytes per user
+    """
+    import gc
+    import tracemalloc
+    from models.base import DATA
+    from models.user import User
+    User.rebuild_indexes()
+    DATA['User'] = {}
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    users = make_users(count)
+    del users
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    print("User store, {} users (bytes/user)".format(count))
+    print("{:>22} {:>12.0f}".format("store and indexes", used / count))
+    print("{:>22} {:>12.0f}".format(
+        "object", sys.getsizeof(User.get(next(iter(DATA['User']))))))
+
+
+def bench_to_json(count: int = 200000) -> None:
+    """ User.to_json throughput
+    """
+    users = make_users(count)
+    print("User.to_json, {} users (objects/sec)".format(count))
+    for for_serialization in (False, True):
+        start = time.perf_counter()
+        for user in users:
+            user.to_json(for_serialization)
+        elapsed = time.perf_counter() - start
+        print("{:>22} {:>12.0f}".format(
+            "for_serialization" if for_serialization else "public",
+            count / elapsed))
+
+
+def bench_pagination(count: int = 1000000, page_size: int = 100) -> None:
+    """ GET /api/v1/users work: the whole list against one page,
+    and the memory peak of encoding everything as a list or a stream
+    """
+    import json
+    import tracemalloc
+    from models.user import User
+    make_users(count)
+    print("users listing, {} users".format(count))
+    User.page(1)
+
+    start = time.perf_counter()
+    json.dumps([user.to_json() for user in User.all()])
+    elapsed = time.perf_counter() - start
+    print("{:>22} {:>12.4f} s".format("whole list", elapsed))
+
+    after = None
+    start = time.perf_counter()
+    for _ in range(100):
+        users = User.page(page_size, after)
+        json.dumps([user.to_json() for user in users])
+        after = users[-1].id
+    elapsed = time.perf_counter() - start
+    print("{:>22} {:>12.4f} s".format(
+        "page of {}".format(page_size), elapsed / 100))
+
+    for name in ("whole list", "stream"):
+        tracemalloc.start()
+        if name == "stream":
+            for user in User.iter_ordered():
+                json.dumps(user.to_json())
+        else:
+            json.dumps([user.to_json() for user in User.all()])
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print("{:>22} {:>12.2f} MB peak".format(name, peak / 2 ** 20))
+
+
+def bench_projection(count: int = 200000) -> None:
+    """ GET /api/v1/users body: full dump against fields=id,email
+    and an email= filter
+    """
+    import json
+    from models.user import User
+    make_users(count)
+    email = "user{}@example.com".format(count // 2)
+    print("users listing, {} users".format(count))
+    for name, attributes, fields in (
+            ("full dump", {}, None),
+            ("fields=id,email", {}, ["id", "email"]),
+            ("email=", {"email": email}, None)):
+        start = time.perf_counter()
+        body = json.dumps([user.to_json(fields=fields)
+                           for user in User.search(attributes)])
+        elapsed = time.perf_counter() - start
+        print("{:>22} {:>12.4f} s {:>12} bytes".format(
+            name, elapsed, len(body)))
+
+
+BENCHMARKS = {
+    "require_auth": bench_require_auth,
+    "search": bench_search,
+    "save": bench_save,
+    "group_commit": bench_group_commit,
+    "startup": bench_startup,
+    "stress": stress_store,
+    "memory": bench_memory,
+    "to_json": bench_to_json,
+    "pagination": bench_pagination,
+    "projection": bench_projection,
+}
+
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or BENCHMARKS:
+        BENCHMARKS[name]()
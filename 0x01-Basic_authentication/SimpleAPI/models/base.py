@@ -1,39 +1,144 @@
 #!/usr/bin/env python3
 """ Base module
 """
+from bisect import bisect_left, bisect_right, insort
 from datetime import datetime
-from typing import TypeVar, List, Iterable
-from os import path
+from typing import TypeVar, List, Iterable, Iterator
+from os import getenv, path
 import json
+import threading
 import uuid
+from models.group_commit import get_committer
+from models.journal import get_journal
+from models.snapshot import LazyObjects, write_snapshot
 
 
 TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
+# "file" rewrites .db_<Class>.json on every change,
+# "journal" appends to .db_<Class>.journal (see models/journal.py)
+STORAGE = getenv("MODELS_STORAGE", "file")
+# with an interval > 0, changes are flushed together in the background
+# (see models/group_commit.py)
+GROUP_COMMIT_INTERVAL = float(getenv("MODELS_GROUP_COMMIT_INTERVAL", "0"))
+GROUP_COMMIT_BATCH = int(getenv("MODELS_GROUP_COMMIT_BATCH", "1000"))
+# load_from_file only reads the record offsets and the indexed
+# attributes, objects are built on first access (see models/snapshot.py)
+LAZY_LOAD = getenv("MODELS_LAZY_LOAD", "0") == "1"
 DATA = {}
+# class name -> attribute -> value -> {id: None}, the ids in the
+# order they were indexed. Objects are looked up in DATA
+INDEXES = {}
+# class name -> id -> {attribute: value it is indexed under}
+INDEXED_VALUES = {}
+# class name -> sorted list of ids, for pages; None until first use
+ORDERED_IDS = {}
+# class name -> (version, last change), the version goes up with
+# every change of the collection. EPOCH tells processes apart
+VERSIONS = {}
+EPOCH = uuid.uuid4().hex
+# class name -> lock serializing the writers of the class: changes
+# to DATA and INDEXES and their persistence. Readers do not take it,
+# they work on copies of DATA made in one step under the GIL
+WRITE_LOCKS = {}
+# (class, for_serialization) -> attributes to_json serializes
+JSON_PLANS = {}
+# attribute not set yet
+_UNSET = object()
+_write_locks_lock = threading.Lock()
+
+
+def _write_lock(s_class: str) -> threading.RLock:
+    """ Write lock of a model class
+    """
+    lock = WRITE_LOCKS.get(s_class)
+    if lock is None:
+        with _write_locks_lock:
+            lock = WRITE_LOCKS.setdefault(s_class, threading.RLock())
+    return lock
+
+
+def _touch(s_class: str):
+    """ Record a change of the collection, write lock held
+    """
+    version = VERSIONS.get(s_class, (0, None))[0]
+    VERSIONS[s_class] = (version + 1, datetime.utcnow())
+
+
+def _add_to_indexes(indexes: dict, indexed_values: dict,
+                    obj_id: str, values: dict):
+    """ Index obj_id under its {attribute: value}, write lock held
+    """
+    indexed = {}
+    for attr, index in indexes.items():
+        value = values.get(attr)
+        try:
+            index.setdefault(value, {})[obj_id] = None
+        except TypeError:
+            # unhashable value, only found by a scan
+            continue
+        indexed[attr] = value
+    if indexed:
+        # values is shared when every attribute was indexed
+        indexed_values[obj_id] = \
+            values if len(indexed) == len(values) else indexed
+
+
+def _parse_timestamp(value: str) -> datetime:
+    """ Parse a TIMESTAMP_FORMAT string
+    fromisoformat is much faster than strptime and gives the same
+    result on the exact "YYYY-MM-DDTHH:MM:SS" shape
+    """
+    if len(value) == 19 and value[10] == "T":
+        try:
+            timestamp = datetime.fromisoformat(value)
+            if timestamp.tzinfo is None:
+                return timestamp
+        except ValueError:
+            pass
+    return datetime.strptime(value, TIMESTAMP_FORMAT)
+
+
+def _format_timestamp(value: datetime) -> str:
+    """ Format a datetime with TIMESTAMP_FORMAT
+    isoformat gives the same string, faster, for naive datetimes
+    """
+    if value.tzinfo is None and value.year >= 1000:
+        return value.isoformat(timespec="seconds")
+    return value.strftime(TIMESTAMP_FORMAT)
 
 
 class Base():
     """ Base class
+    Subclasses list in _indexed_attributes the attributes
+    search() can look up through a hash index.
+    Attributes live in __slots__: subclasses declare theirs
+    there too, to_json serializes them in declaration order
     """
 
+    __slots__ = ("id", "created_at", "updated_at", "_version")
+    _indexed_attributes = ()
+
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a Base instance
         """
         s_class = str(self.__class__.__name__)
         if DATA.get(s_class) is None:
-            DATA[s_class] = {}
+            with _write_lock(s_class):
+                if DATA.get(s_class) is None:
+                    DATA[s_class] = {}
+                    self.__class__.rebuild_indexes()
 
         self.id = kwargs.get('id', str(uuid.uuid4()))
         if kwargs.get('created_at') is not None:
-            self.created_at = datetime.strptime(kwargs.get('created_at'),
-                                                TIMESTAMP_FORMAT)
+            self.created_at = _parse_timestamp(kwargs.get('created_at'))
         else:
             self.created_at = datetime.utcnow()
         if kwargs.get('updated_at') is not None:
-            self.updated_at = datetime.strptime(kwargs.get('updated_at'),
-                                                TIMESTAMP_FORMAT)
+            self.updated_at = _parse_timestamp(kwargs.get('updated_at'))
         else:
             self.updated_at = datetime.utcnow()
+        # number of saves, tells apart changes within a timestamp
+        self._version = kwargs.get('_version', 0)
 
     def __eq__(self, other: TypeVar('Base')) -> bool:
         """ Equality
@@ -44,62 +149,232 @@ class Base():
             return False
         return (self.id == other.id)
 
-    def to_json(self, for_serialization: bool = False) -> dict:
+    @classmethod
+    def _json_plan(cls, for_serialization: bool) -> tuple:
+        """ Attributes to_json serializes, computed once per class
+        """
+        plan = []
+        names = set()
+        for klass in reversed(cls.__mro__):
+            for key in klass.__dict__.get("__slots__", ()):
+                if key in names or key in ("__dict__", "__weakref__"):
+                    continue
+                names.add(key)
+                if not for_serialization and key[0] == '_':
+                    continue
+                plan.append(key)
+        plan = tuple(plan)
+        JSON_PLANS[(cls, for_serialization)] = plan
+        return plan
+
+    @classmethod
+    def json_fields(cls) -> tuple:
+        """ Public attributes of the class, as named in to_json
+        """
+        plan = JSON_PLANS.get((cls, False))
+        if plan is None:
+            plan = cls._json_plan(False)
+        return plan
+
+    def to_json(self, for_serialization: bool = False,
+                fields: Iterable[str] = None) -> dict:
         """ Convert the object a JSON dictionary
+        - fields: only these attributes, the others are not formatted
         """
+        plan = JSON_PLANS.get((self.__class__, for_serialization))
+        if plan is None:
+            plan = self._json_plan(for_serialization)
+        if fields is not None:
+            plan = [key for key in plan if key in fields]
         result = {}
-        for key, value in self.__dict__.items():
+        for key in plan:
+            value = getattr(self, key, _UNSET)
+            if value is _UNSET:
+                continue
+            if type(value) is datetime:
+                value = _format_timestamp(value)
+            result[key] = value
+        # attributes of subclasses without __slots__
+        for key, value in list(getattr(self, "__dict__", {}).items()):
             if not for_serialization and key[0] == '_':
                 continue
+            if fields is not None and key not in fields:
+                continue
             if type(value) is datetime:
-                result[key] = value.strftime(TIMESTAMP_FORMAT)
+                result[key] = _format_timestamp(value)
             else:
                 result[key] = value
         return result
 
     @classmethod
-    def load_from_file(cls):
+    def load_from_file(cls, lazy: bool = None):
         """ Load all objects from file
+        in journal storage the journal is replayed over the file
+        - lazy: only index the records, objects are built on first
+          access. LAZY_LOAD by default
         """
         s_class = cls.__name__
         file_path = ".db_{}.json".format(s_class)
-        DATA[s_class] = {}
-        if not path.exists(file_path):
-            return
-
-        with open(file_path, 'r') as f:
-            objs_json = json.load(f)
-            for obj_id, obj_json in objs_json.items():
-                DATA[s_class][obj_id] = cls(**obj_json)
+        if lazy is None:
+            lazy = LAZY_LOAD
+        with _write_lock(s_class):
+            DATA[s_class] = {}
+            store = None
+            if lazy and path.exists(file_path):
+                store = LazyObjects.open(cls, file_path)
+            if store is not None:
+                DATA[s_class] = store
+            elif path.exists(file_path):
+                with open(file_path, 'r') as f:
+                    objs_json = json.load(f)
+                    for obj_id, obj_json in objs_json.items():
+                        DATA[s_class][obj_id] = cls(**obj_json)
+            if STORAGE == "journal":
+                for record in get_journal(s_class).replay():
+                    if record["op"] == "save":
+                        DATA[s_class][record["id"]] = cls(**record["obj"])
+                    else:
+                        DATA[s_class].pop(record["id"], None)
+            # a lazy store gives the indexed values of the records
+            # it did not load, read with their offsets
+            cls.rebuild_indexes()
 
     @classmethod
     def save_to_file(cls):
         """ Save all objects to file
         """
         s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        objs_json = {}
-        for obj_id, obj in DATA[s_class].items():
-            objs_json[obj_id] = obj.to_json(True)
+        with _write_lock(s_class):
+            if STORAGE == "journal":
+                get_journal(s_class).compact(cls._snapshot_items,
+                                             background=False)
+                return
+            write_snapshot(".db_{}.json".format(s_class),
+                           cls._snapshot_items())
 
-        with open(file_path, 'w') as f:
-            json.dump(objs_json, f)
+    @classmethod
+    def _snapshot_items(cls) -> list:
+        """ (id, object) pairs to write to the snapshot, records
+        not loaded yet are passed on as raw JSON
+        """
+        objs = DATA[cls.__name__]
+        if isinstance(objs, LazyObjects):
+            return list(objs.raw_items())
+        # copied in one step, no lock needed
+        return list(objs.items())
 
-    def save(self):
+    def save(self, durable: bool = False):
         """ Save current object
+        durable: fsynced whatever MODELS_JOURNAL_FSYNC says,
+        with group commit it also waits for the flush
         """
         s_class = self.__class__.__name__
-        self.updated_at = datetime.utcnow()
-        DATA[s_class][self.id] = self
-        self.__class__.save_to_file()
+        with _write_lock(s_class):
+            self.updated_at = datetime.utcnow()
+            self._version += 1
+            _touch(s_class)
+            ordered = ORDERED_IDS.get(s_class)
+            if ordered is not None and self.id not in DATA[s_class]:
+                insort(ordered, self.id)
+            DATA[s_class][self.id] = self
+            self._unindex()
+            self._index()
+            pending = self._persist("save", durable)
+        if durable and pending is not None:
+            # outside the lock, the flusher needs it
+            pending[0].wait(pending[1])
 
-    def remove(self):
+    def remove(self, durable: bool = False):
         """ Remove object
+        durable: fsynced whatever MODELS_JOURNAL_FSYNC says,
+        with group commit it also waits for the flush
         """
         s_class = self.__class__.__name__
-        if DATA[s_class].get(self.id) is not None:
-            del DATA[s_class][self.id]
-            self.__class__.save_to_file()
+        pending = None
+        with _write_lock(s_class):
+            if DATA[s_class].get(self.id) is not None:
+                del DATA[s_class][self.id]
+                _touch(s_class)
+                ordered = ORDERED_IDS.get(s_class)
+                if ordered is not None:
+                    i = bisect_left(ordered, self.id)
+                    if i < len(ordered) and ordered[i] == self.id:
+                        del ordered[i]
+                self._unindex()
+                pending = self._persist("remove", durable)
+        if durable and pending is not None:
+            pending[0].wait(pending[1])
+
+    def _persist(self, op: str, durable: bool = False) -> tuple:
+        """ Write a save or a remove to the storage,
+        or leave it to the group commit flusher.
+        - durable: the flush of the change is fsynced
+        Called with the write lock held, returns the
+        (committer, ticket) to wait on with group commit
+        """
+        cls = self.__class__
+        s_class = cls.__name__
+        if GROUP_COMMIT_INTERVAL > 0:
+            committer = get_committer(s_class, cls._flush_dirty,
+                                      GROUP_COMMIT_INTERVAL,
+                                      GROUP_COMMIT_BATCH)
+            return committer, committer.mark(self.id, op, durable)
+        elif STORAGE == "journal":
+            journal = get_journal(s_class)
+            if op == "save":
+                record = {"op": "save", "id": self.id,
+                          "obj": self.to_json(True)}
+            else:
+                record = {"op": "remove", "id": self.id}
+            journal.append_batch([record], durable)
+            cls._compact_if_needed(journal)
+        else:
+            cls.save_to_file()
+
+    @classmethod
+    def _flush_dirty(cls, dirty: dict, durable: bool = False):
+        """ Persist the objects changed since the last group commit
+        - dirty: {object id: "save" or "remove"}
+        - durable: a waiter needs the changes fsynced
+        """
+        s_class = cls.__name__
+        if STORAGE != "journal":
+            # one rewrite covers every change
+            cls.save_to_file()
+            return
+        records = []
+        with _write_lock(s_class):
+            for obj_id, op in dirty.items():
+                obj = DATA[s_class].get(obj_id)
+                if op == "save" and obj is not None:
+                    records.append({"op": "save", "id": obj_id,
+                                    "obj": obj.to_json(True)})
+                elif op == "remove" and obj is None:
+                    records.append({"op": "remove", "id": obj_id})
+        journal = get_journal(s_class)
+        journal.append_batch(records, durable)
+        cls._compact_if_needed(journal)
+
+    @classmethod
+    def _compact_if_needed(cls, journal):
+        """ Fold a long journal into a snapshot in the background
+        """
+        if journal.should_compact():
+            journal.compact(cls._snapshot_items)
+
+    @classmethod
+    def collection_version(cls) -> tuple:
+        """ (version, last change) of all objects of the class,
+        the version is unique to this process
+        """
+        version, changed_at = VERSIONS.get(cls.__name__, (0, None))
+        return "{}-{}".format(EPOCH, version), changed_at
+
+    def etag(self) -> str:
+        """ Entity tag of the current state of the object
+        """
+        return "{}-{}-{}".format(self.id, self._version,
+                                 self.updated_at.isoformat())
 
     @classmethod
     def count(cls) -> int:
@@ -122,8 +397,61 @@ class Base():
         return DATA[s_class].get(id)
 
     @classmethod
-    def search(cls, attributes: dict = {}) -> List[TypeVar('Base')]:
-        """ Search all objects with matching attributes
+    def rebuild_indexes(cls):
+        """ Rebuild the indexes from all objects
+        The new indexes are filled aside and published once complete,
+        searches meanwhile use the previous ones
+        """
+        s_class = cls.__name__
+        attributes = cls._indexed_attributes
+        with _write_lock(s_class):
+            indexes = {attr: {} for attr in attributes}
+            indexed_values = {}
+            objs = DATA.get(s_class, {})
+            if not indexes:
+                pairs = ()
+            elif isinstance(objs, LazyObjects):
+                # records not loaded yet stay so
+                pairs = objs.attribute_values(attributes)
+            else:
+                pairs = ((obj_id, {attr: getattr(obj, attr, None)
+                                   for attr in attributes})
+                         for obj_id, obj in list(objs.items()))
+            for obj_id, values in pairs:
+                _add_to_indexes(indexes, indexed_values, obj_id, values)
+            INDEXES[s_class] = indexes
+            INDEXED_VALUES[s_class] = indexed_values
+            # sorted again by the next page()
+            ORDERED_IDS[s_class] = None
+            _touch(s_class)
+
+    def _index(self):
+        """ Add current object to the indexes
+        """
+        s_class = self.__class__.__name__
+        indexes = INDEXES.get(s_class)
+        if indexes:
+            _add_to_indexes(indexes, INDEXED_VALUES[s_class], self.id, {
+                attr: getattr(self, attr, None) for attr in indexes})
+
+    def _unindex(self):
+        """ Remove the id of current object from the indexes,
+        using the values it was indexed with. DATA holds one object
+        per id, so this also drops another instance saved before
+        """
+        s_class = self.__class__.__name__
+        indexes = INDEXES.get(s_class) or {}
+        indexed = INDEXED_VALUES.get(s_class, {}).pop(self.id, {})
+        for attr, value in indexed.items():
+            bucket = indexes.get(attr, {}).get(value)
+            if bucket is not None:
+                bucket.pop(self.id, None)
+                if not bucket:
+                    indexes[attr].pop(value, None)
+
+    @classmethod
+    def _scan(cls, attributes: dict) -> List[TypeVar('Base')]:
+        """ Search by checking every object
         """
         s_class = cls.__name__
         def _search(obj):
@@ -133,5 +461,93 @@ class Base():
                 if (getattr(obj, k) != v):
                     return False
             return True
-        
-        return list(filter(_search, DATA[s_class].values()))
+
+        return list(filter(_search, list(DATA[s_class].values())))
+
+    @classmethod
+    def search(cls, attributes: dict = {}) -> List[TypeVar('Base')]:
+        """ Search all objects with matching attributes
+        An indexed attribute narrows the candidates down,
+        other queries scan every object
+        """
+        s_class = cls.__name__
+        indexes = INDEXES.get(s_class) or {}
+        for k, v in attributes.items():
+            if k not in indexes:
+                continue
+            try:
+                candidates = indexes[k].get(v, {})
+            except TypeError:
+                continue
+            objs = DATA.get(s_class, {})
+            found = []
+            for obj_id in list(candidates):
+                obj = objs.get(obj_id)
+                # checked again, the object may have changed since
+                # it was saved
+                if obj is not None and all(
+                        getattr(obj, key) == value
+                        for key, value in attributes.items()):
+                    found.append(obj)
+            return found
+        return cls._scan(attributes)
+
+    @classmethod
+    def page(cls, limit: int, after: str = None,
+             attributes: dict = None) -> List[TypeVar('Base')]:
+        """ Up to limit objects ordered by id, starting
+        after the id after (cursor of the previous page)
+        - attributes: only objects matching them, found by search()
+        """
+        if attributes:
+            return cls._matching_ordered(attributes, after)[:limit]
+        s_class = cls.__name__
+        ordered = ORDERED_IDS.get(s_class)
+        if ordered is None:
+            with _write_lock(s_class):
+                ordered = ORDERED_IDS.get(s_class)
+                if ordered is None:
+                    ordered = sorted(DATA.get(s_class, {}))
+                    ORDERED_IDS[s_class] = ordered
+        start = 0 if after is None else bisect_right(ordered, after)
+        objs = []
+        # ids are read a slice at a time, the list may change meanwhile
+        while len(objs) < limit:
+            ids = ordered[start:start + limit - len(objs)]
+            if not ids:
+                break
+            objs_store = DATA.get(s_class, {})
+            for obj_id in ids:
+                obj = objs_store.get(obj_id)
+                if obj is not None:
+                    objs.append(obj)
+            start = bisect_right(ordered, ids[-1])
+        return objs
+
+    @classmethod
+    def iter_ordered(cls, after: str = None, batch: int = 1000,
+                     attributes: dict = None) -> Iterator[TypeVar('Base')]:
+        """ All objects ordered by id, fetched a page at a time
+        so only one batch is held in memory
+        - attributes: only objects matching them, found by search()
+        """
+        if attributes:
+            yield from cls._matching_ordered(attributes, after)
+            return
+        while True:
+            objs = cls.page(batch, after)
+            if not objs:
+                return
+            yield from objs
+            after = objs[-1].id
+
+    @classmethod
+    def _matching_ordered(cls, attributes: dict,
+                          after: str = None) -> List[TypeVar('Base')]:
+        """ Objects matching attributes ordered by id, after the id after
+        """
+        objs = sorted(cls.search(attributes), key=lambda obj: obj.id)
+        if after is None:
+            return objs
+        start = bisect_right([obj.id for obj in objs], after)
+        return objs[start:]
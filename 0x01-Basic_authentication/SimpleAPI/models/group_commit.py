@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+""" Group commit module
+Changes are marked dirty in memory and a background flusher
+persists them together, once per interval or batch size.
+"""
+from typing import Callable, Dict
+import atexit
+import threading
+import time
+
+
+class GroupCommitter():
+    """ Coalesces the writes of one model class
+    """
+
+    def __init__(self, flush: Callable[[Dict[str, str], bool], None],
+                 interval: float = 0.05, batch_size: int = 1000):
+        """ Initialize a GroupCommitter
+        - flush: persists {object id: "save" or "remove"}, and
+          fsyncs when its second argument is True
+        - interval: seconds a change may wait before its flush
+        - batch_size: pending changes that trigger a flush right away
+        """
+        self._flush = flush
+        self.interval = interval
+        self.batch_size = batch_size
+        self._dirty = {}
+        self._marked = 0
+        self._flushed = 0
+        self._error = None
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._urgent = False
+        # a change of the pending batch was marked durable
+        self._durable = False
+        self.writes = 0
+        self.flushes = 0
+        self.flushed_objects = 0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def mark(self, obj_id: str, op: str, durable: bool = False) -> int:
+        """ Mark an object dirty, the last op of an object wins.
+        - durable: the flush of this change is fsynced whatever
+          the fsync policy of the storage
+        Returns a ticket to wait on
+        """
+        with self._cond:
+            self._dirty[obj_id] = op
+            self._durable = self._durable or durable
+            self._marked += 1
+            self.writes += 1
+            if len(self._dirty) == 1 or len(self._dirty) >= self.batch_size:
+                # wakes the flusher up: first change or full batch
+                self._cond.notify_all()
+            return self._marked
+
+    def wait(self, ticket: int, timeout: float = None) -> bool:
+        """ Wait until the change of ticket is persisted
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._flushed < ticket:
+                if self._error is not None:
+                    raise self._error
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                self._cond.wait(remaining)
+            return True
+
+    def _run(self):
+        """ Flusher loop
+        """
+        while True:
+            with self._cond:
+                while not self._dirty and not self._stopped:
+                    self._cond.wait()
+                if not self._dirty:
+                    return
+                # let the batch fill up for at most interval
+                self._cond.wait_for(
+                    lambda: len(self._dirty) >= self.batch_size
+                    or self._stopped or self._urgent, self.interval)
+                self._urgent = False
+                dirty, self._dirty = self._dirty, {}
+                durable, self._durable = self._durable, False
+                ticket = self._marked
+            try:
+                self._flush(dirty, durable)
+                error = None
+            except Exception as e:
+                error = e
+            with self._cond:
+                self._error = error
+                if error is None:
+                    self._flushed = ticket
+                    self.flushes += 1
+                    self.flushed_objects += len(dirty)
+                else:
+                    # keep the changes for the next flush
+                    for obj_id, op in dirty.items():
+                        self._dirty.setdefault(obj_id, op)
+                    self._durable = self._durable or durable
+                    if self._stopped:
+                        return
+                self._cond.notify_all()
+
+    def flush(self):
+        """ Persist everything marked so far
+        """
+        with self._cond:
+            ticket = self._marked
+            self._urgent = True
+            self._cond.notify_all()
+        self.wait(ticket)
+
+    def stop(self):
+        """ Flush and stop the flusher
+        """
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def metrics(self) -> dict:
+        """ Writes, flushes and writes coalesced per flush
+        """
+        with self._cond:
+            return {"writes": self.writes,
+                    "flushes": self.flushes,
+                    "flushed_objects": self.flushed_objects,
+                    "pending": len(self._dirty),
+                    "coalesced": self.writes - len(self._dirty)
+                    - self.flushed_objects,
+                    "writes_per_flush": (self.writes - len(self._dirty))
+                    / self.flushes if self.flushes else 0.0}
+
+
+COMMITTERS = {}
+_committers_lock = threading.Lock()
+
+
+def get_committer(s_class: str,
+                  flush: Callable[[Dict[str, str], bool], None],
+                  interval: float, batch_size: int) -> GroupCommitter:
+    """ GroupCommitter of a model class, started on first use
+    """
+    with _committers_lock:
+        if s_class not in COMMITTERS:
+            COMMITTERS[s_class] = GroupCommitter(flush, interval, batch_size)
+        return COMMITTERS[s_class]
+
+
+@atexit.register
+def stop_all():
+    """ Flush every pending change before the process exits
+    """
+    with _committers_lock:
+        committers = list(COMMITTERS.values())
+        COMMITTERS.clear()
+    for committer in committers:
+        committer.stop()
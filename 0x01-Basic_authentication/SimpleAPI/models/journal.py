@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+""" Journal module
+Append-only persistence of a model class:
+- `.db_<Class>.json` is a snapshot, written by models/snapshot.py
+- `.db_<Class>.journal` holds one JSON record per save/remove
+  made since the snapshot
+Compaction folds the journal into a new snapshot in the background.
+"""
+from os import getenv, path
+from typing import Callable, Iterator
+import json
+import os
+import threading
+import time
+from models.snapshot import write_snapshot
+
+
+FSYNC_POLICIES = ("always", "interval", "never")
+
+
+class Journal():
+    """ Journal of one model class
+    """
+
+    def __init__(self, s_class: str, fsync: str = "interval",
+                 fsync_interval: float = 1.0, compact_every: int = 10000):
+        """ Initialize a Journal
+        - fsync: "always" after each record, "interval" at most every
+          fsync_interval seconds, "never" leaves it to the OS
+        - compact_every: journal records that trigger a compaction
+        """
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError("fsync must be one of {}".format(
+                ", ".join(FSYNC_POLICIES)))
+        self.snapshot_path = ".db_{}.json".format(s_class)
+        self.journal_path = ".db_{}.journal".format(s_class)
+        self.compacting_path = self.journal_path + ".compacting"
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.compact_every = compact_every
+        self.records = 0
+        self._file = None
+        self._last_fsync = time.monotonic()
+        self._lock = threading.Lock()
+        self._compactor = None
+
+    def _open(self):
+        """ Journal file, opened for append on first use
+        """
+        if self._file is None:
+            self._file = open(self.journal_path, 'a')
+        return self._file
+
+    def _write(self, records: list, fsync: bool = False):
+        """ Append records following the fsync policy,
+        fsync forces one
+        """
+        f = self._open()
+        f.write("".join(json.dumps(record) + "\n" for record in records))
+        f.flush()
+        now = time.monotonic()
+        if fsync or self.fsync == "always" or (
+                self.fsync == "interval"
+                and now - self._last_fsync >= self.fsync_interval):
+            os.fsync(f.fileno())
+            self._last_fsync = now
+        self.records += len(records)
+
+    def append_batch(self, records: list, fsync: bool = False):
+        """ Record many changes, with at most one fsync
+        - fsync: fsync now whatever the policy, so the batch
+          and the records before it are durable
+        """
+        if records or fsync:
+            with self._lock:
+                self._write(records, fsync)
+
+    def should_compact(self) -> bool:
+        """ True once the journal has grown past compact_every
+        """
+        return self.compact_every > 0 and self.records >= self.compact_every
+
+    @staticmethod
+    def _read(file_path: str) -> Iterator[dict]:
+        """ Records of a journal file. A torn last line left by a
+        crash is cut off so later appends start on a clean line
+        """
+        if not path.exists(file_path):
+            return
+        good = 0
+        with open(file_path, 'rb') as f:
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("torn record")
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                good += len(line)
+                yield record
+        if good < path.getsize(file_path):
+            with open(file_path, 'r+b') as f:
+                f.truncate(good)
+
+    def replay(self) -> Iterator[dict]:
+        """ Records to apply over the snapshot, oldest first
+        """
+        count = 0
+        # left over by a compaction that did not finish
+        for record in self._read(self.compacting_path):
+            count += 1
+            yield record
+        for record in self._read(self.journal_path):
+            count += 1
+            yield record
+        self.records = count
+
+    def compact(self, objects: Callable[[], list],
+                background: bool = True):
+        """ Write a new snapshot and drop the records it covers
+        - objects: returns the current (id, object) pairs, called
+          right after the journal is rotated. Later changes go to the
+          new journal and are replayed over the snapshot
+        """
+        with self._lock:
+            if self._compactor is not None and self._compactor.is_alive():
+                return
+            if self._file is not None:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._file.close()
+                self._file = None
+            if path.exists(self.journal_path):
+                if path.exists(self.compacting_path):
+                    # keep the records of the unfinished compaction
+                    with open(self.compacting_path, 'a') as dst, \
+                            open(self.journal_path, 'r') as src:
+                        dst.write(src.read())
+                    os.remove(self.journal_path)
+                else:
+                    os.replace(self.journal_path, self.compacting_path)
+            self.records = 0
+            current = objects()
+        if background:
+            self._compactor = threading.Thread(
+                target=self._write_snapshot, args=(current,), daemon=True)
+            self._compactor.start()
+        else:
+            self._write_snapshot(current)
+
+    def _write_snapshot(self, current: list):
+        """ Write the snapshot atomically, then drop the rotated journal
+        """
+        write_snapshot(self.snapshot_path, current)
+        if path.exists(self.compacting_path):
+            os.remove(self.compacting_path)
+
+    def wait(self):
+        """ Wait for a running compaction
+        """
+        compactor = self._compactor
+        if compactor is not None:
+            compactor.join()
+
+    def close(self):
+        """ Flush and close the journal file
+        """
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._file.close()
+                self._file = None
+
+
+JOURNALS = {}
+_journals_lock = threading.Lock()
+
+
+def get_journal(s_class: str) -> Journal:
+    """ Journal of a model class, configured from the environment
+    """
+    with _journals_lock:
+        if s_class not in JOURNALS:
+            JOURNALS[s_class] = Journal(
+                s_class,
+                fsync=getenv("MODELS_JOURNAL_FSYNC", "interval"),
+                fsync_interval=float(getenv("MODELS_JOURNAL_FSYNC_INTERVAL",
+                                            "1.0")),
+                compact_every=int(getenv("MODELS_JOURNAL_COMPACT_EVERY",
+                                         "10000")))
+        return JOURNALS[s_class]
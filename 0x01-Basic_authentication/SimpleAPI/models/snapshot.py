@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+""" Snapshot module
+`.db_<Class>.json` is written with one object per line:
+    {
+    "<id>": {...},
+    "<id>": {...}
+    }
+It stays plain JSON, and the line layout lets LazyObjects index the
+record offsets at startup and parse an object only when it is used.
+"""
+from collections.abc import MutableMapping
+from typing import Iterable, Iterator, Tuple
+import json
+import os
+import re
+import threading
+
+
+def write_snapshot(file_path: str, items: Iterable[Tuple[str, object]]):
+    """ Write objects atomically, one per line
+    - items: (id, object) pairs, the object being a model instance
+      or the raw JSON text of a record not loaded yet
+    """
+    tmp_path = file_path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        f.write("{")
+        separator = "\n"
+        for obj_id, value in items:
+            if not isinstance(value, str):
+                value = json.dumps(value.to_json(True))
+            f.write(separator + json.dumps(obj_id) + ": " + value)
+            separator = ",\n"
+        f.write("\n}")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, file_path)
+
+
+def _value_pattern(attribute: str):
+    """ Regex of a "attribute": <string or scalar> pair in a record
+    written by json.dumps. It starts with a literal, which is fast
+    to look for; _scan_values checks it is a top level key
+    """
+    return re.compile(b'"' + re.escape(attribute.encode())
+                      + rb'": ("(?:[^"\\]|\\.)*"|[^,}"\[{]*)[,}]')
+
+
+def _scan_values(record: bytes, patterns: list) -> dict:
+    """ {attribute: value} of a raw record, read without parsing
+    the whole record unless a value is not a plain one
+    """
+    values = {}
+    for attr, pattern in patterns:
+        match = pattern.search(record)
+        try:
+            # a key follows "{" or ", ", a quote in a value is escaped
+            if record[match.start() - 1] not in b"{ ":
+                raise ValueError
+            token = match.group(1)
+            if token[:1] == b'"' and b'\\' not in token:
+                values[attr] = token[1:-1].decode()
+            else:
+                values[attr] = json.loads(token)
+        except (AttributeError, ValueError):
+            # missing, nested or odd value: parse the record
+            obj_json = json.loads(record)
+            return {attr: obj_json.get(attr) for attr, _ in patterns}
+    return values
+
+
+class LazyObjects(MutableMapping):
+    """ Objects of a model class backed by a snapshot file.
+    Records are parsed into objects the first time they are read.
+    The file stays open, so a snapshot replaced on disk
+    does not move the records still to be read.
+    The values of the indexed attributes are read at startup
+    with the offsets, so indexes are built without the objects
+    """
+
+    def __init__(self, cls, f, attributes: Tuple[str, ...] = ()):
+        """ Initialize from an open snapshot file, see open()
+        - attributes: read from every record, see attribute_values()
+        """
+        self._cls = cls
+        self._file = f
+        # id -> object, or (offset, length) of a record not loaded yet
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._attributes = tuple(attributes)
+        # id -> {attribute: value} of the records not loaded yet
+        self._scanned = {}
+        patterns = [(attr, _value_pattern(attr)) for attr in attributes]
+        offset = f.tell()
+        for line in f:
+            if line.startswith(b'"'):
+                end = line.index(b'": ')
+                key = line[1:end]
+                if b'\\' in key:
+                    obj_id = json.loads(line[:end + 1])
+                else:
+                    obj_id = key.decode()
+                record = line[end + 3:].rstrip(b",\n")
+                self._entries[obj_id] = (offset + end + 3, len(record))
+                if patterns:
+                    self._scanned[obj_id] = _scan_values(record, patterns)
+            offset += len(line)
+
+    @classmethod
+    def open(cls, model_cls, file_path: str):
+        """ LazyObjects over file_path, None when the file is
+        not in the one object per line layout.
+        The indexed attributes of model_cls are read at startup
+        """
+        f = open(file_path, 'rb')
+        if f.readline() != b"{\n":
+            f.close()
+            return None
+        return cls(model_cls, f, model_cls._indexed_attributes)
+
+    def _read(self, location: tuple) -> str:
+        """ Raw JSON text of a record
+        """
+        offset, length = location
+        with self._lock:
+            self._file.seek(offset)
+            return self._file.read(length).decode()
+
+    def __getitem__(self, obj_id: str):
+        value = self._entries[obj_id]
+        if type(value) is tuple:
+            obj = self._cls(**json.loads(self._read(value)))
+            with self._lock:
+                # another thread may have loaded or replaced it
+                if self._entries.get(obj_id) is value:
+                    self._entries[obj_id] = obj
+                    self._scanned.pop(obj_id, None)
+                value = self._entries[obj_id]
+        return value
+
+    def __setitem__(self, obj_id: str, obj):
+        self._entries[obj_id] = obj
+        self._scanned.pop(obj_id, None)
+
+    def __delitem__(self, obj_id: str):
+        del self._entries[obj_id]
+        self._scanned.pop(obj_id, None)
+
+    def __contains__(self, obj_id) -> bool:
+        return obj_id in self._entries
+
+    def __iter__(self) -> Iterator[str]:
+        # a copy, other threads may add or remove objects meanwhile
+        return iter(list(self._entries))
+
+    def values(self) -> list:
+        """ Objects present when called, loading the pending ones
+        """
+        objs = []
+        for obj_id in self:
+            obj = self.get(obj_id)
+            if obj is not None:
+                objs.append(obj)
+        return objs
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def raw_items(self) -> Iterator[Tuple[str, object]]:
+        """ (id, object) pairs, the raw JSON text standing
+        for the records not loaded yet
+        """
+        for obj_id, value in list(self._entries.items()):
+            if type(value) is tuple:
+                value = self._read(value)
+            yield obj_id, value
+
+    def attribute_values(self, attributes: Tuple[str, ...]
+                         ) -> Iterator[Tuple[str, dict]]:
+        """ (id, {attribute: value}) of every object. Records not
+        loaded yet give the values read at startup when attributes
+        were among them, they are loaded otherwise
+        """
+        scanned = set(attributes) <= set(self._attributes)
+        for obj_id, value in list(self._entries.items()):
+            if type(value) is tuple:
+                values = self._scanned.get(obj_id) if scanned else None
+                if values is not None:
+                    yield obj_id, values
+                    continue
+                value = self.get(obj_id)
+                if value is None:
+                    continue
+            yield obj_id, {attr: getattr(value, attr, None)
+                           for attr in attributes}
+
+    def pending(self) -> int:
+        """ Number of records not loaded yet
+        """
+        return sum(1 for value in list(self._entries.values())
+                   if type(value) is tuple)
@@ -3,6 +3,7 @@
 Route module for the API
 """
 from os import getenv
+from api.v1.auth.auth import PathMatcher
 from api.v1.views import app_views
 from flask import Flask, jsonify, abort, request
 from flask_cors import (CORS, cross_origin)
@@ -22,6 +23,11 @@ if AUTH_TYPE == "auth":
     from api.v1.auth.auth import Auth
     auth = Auth()
 
+# compiled once, checked on every request
+EXCLUDED_PATHS = PathMatcher(['/api/v1/status/',
+                              '/api/v1/unauthorized/',
+                              '/api/v1/forbidden/'])
+
 
 @app.errorhandler(404)
 def not_found(error) -> str:
@@ -47,10 +53,7 @@ def checking_auth() -> None:
     """check authentication"""
     if auth is None:
         return
-    allowed_paths = ['/api/v1/status/',
-                     '/api/v1/unauthorized/',
-                     '/api/v1/forbidden/']
-    requires_auth = auth.require_auth(request.path, allowed_paths)
+    requires_auth = auth.require_auth(request.path, EXCLUDED_PATHS)
     if requires_auth is False:  # if it does not require authentication
         pass
     else:
@@ -1,18 +1,58 @@
 #!/usr/bin/env python3
 """authentication class created here"""
 
-from typing import List
+from typing import List, Union
 from flask import request
 
 
+class PathMatcher:
+    """precompiled set of paths excluded from authentication.
+    Exact paths go in a set, paths ending with "*" go in a
+    character trie of their prefix, so a lookup is O(path length)
+    whatever the number of excluded paths"""
+
+    def __init__(self, excluded_paths: List[str]) -> None:
+        """compiles excluded_paths"""
+        self.exact = set()
+        self._trie = {}
+        for excluded in excluded_paths or []:
+            if excluded.endswith("*"):
+                node = self._trie
+                for char in excluded[:-1]:
+                    node = node.setdefault(char, {})
+                node[None] = True  # a prefix ends here
+            else:
+                self.exact.add(excluded)
+
+    def __bool__(self) -> bool:
+        """False when nothing is excluded"""
+        return bool(self.exact or self._trie)
+
+    def __contains__(self, path: str) -> bool:
+        """checks if path is excluded"""
+        if path in self.exact:
+            return True
+        node = self._trie
+        for char in path:
+            if None in node:
+                return True
+            node = node.get(char)
+            if node is None:
+                return False
+        return None in node
+
+
 class Auth:
     """Authentication class"""
 
-    def require_auth(self, path: str, excluded_paths: List[str]) -> bool:
+    def require_auth(self, path: str,
+                     excluded_paths: Union[List[str], PathMatcher]) -> bool:
         """Define which routes don't need authentication
         exluded paths do not require authentication
         if function returns true, path is not in excluded path
-        so it requires authentication"""
+        so it requires authentication
+        excluded_paths can be a PathMatcher built once
+        ahead of time, paths ending with * match any suffix"""
         if path is not None:
             if path[-1] != "/":
                 path = path + "/"  # include the last slash
@@ -20,6 +60,12 @@ class Auth:
             return True
         if excluded_paths is None or excluded_paths == []:
             return True
+        if not isinstance(excluded_paths, PathMatcher):
+            # plain lists are scanned, only worth it for a few paths
+            for excluded in excluded_paths:
+                if excluded.endswith("*") and \
+                        path.startswith(excluded[:-1]):
+                    return False
         if path not in excluded_paths:
             return True
         elif path in excluded_paths:
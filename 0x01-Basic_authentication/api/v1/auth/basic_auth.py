@@ -1,17 +1,91 @@
 #!/usr/bin/env python3
 """basic authentication class created here"""
+from collections import OrderedDict
 from typing import Tuple, TypeVar
 from .auth import Auth
 import base64
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
 from models.user import User
 
 
+class CredentialCache:
+    """bounded, TTL based cache of verified Authorization headers.
+    Headers are keyed on an HMAC with a per-process secret so raw
+    credentials are never kept in memory.
+    An entry stores the user id and the password hash it was verified
+    against, so a removed user or a changed password misses"""
+
+    def __init__(self, max_size: int = 1024, ttl: float = 60.0) -> None:
+        """initialiser"""
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._secret = secrets.token_bytes(32)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, authorization_header: str) -> bytes:
+        """keyed hash of the raw header"""
+        return hmac.new(self._secret, authorization_header.encode(),
+                        hashlib.sha256).digest()
+
+    def get(self, authorization_header: str) -> TypeVar('User'):
+        """returns the cached user or None"""
+        key = self.key(authorization_header)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                user_id, password, expires = entry
+                user = User.get(user_id)
+                if time.monotonic() < expires and user is not None \
+                        and user.password == password:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return user
+                del self._entries[key]
+            self.misses += 1
+        return None
+
+    def put(self, authorization_header: str, user: TypeVar('User')) -> None:
+        """remembers that the header authenticates user"""
+        key = self.key(authorization_header)
+        with self._lock:
+            self._entries[key] = (user.id, user.password,
+                                  time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """drops every entry"""
+        with self._lock:
+            self._entries.clear()
+
+    def metrics(self) -> dict:
+        """hit/miss counters and hit rate"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "hit_rate": self.hits / lookups if lookups else 0.0,
+                    "size": len(self._entries)}
+
+
 class BasicAuth(Auth):
     """Basic Auth class"""
 
     def __init__(self) -> None:
         """initialiser"""
         super().__init__()
+        self.credential_cache = CredentialCache(
+            int(os.getenv("BASIC_AUTH_CACHE_SIZE", "1024")),
+            float(os.getenv("BASIC_AUTH_CACHE_TTL", "60")))
 
     def extract_base64_authorization_header(self,
                                             authorization_header: str) -> str:
@@ -81,14 +155,24 @@ class BasicAuth(Auth):
     def current_user(self, request=None) -> TypeVar('User'):
         """
         Returns a User instance based on a received request
+        a header verified recently is served from the credential cache
         """
         Auth_header = self.authorization_header(request)
         if Auth_header is not None:
+            if self.credential_cache.ttl > 0:
+                user = self.credential_cache.get(Auth_header)
+                if user is not None:
+                    return user
             token = self.extract_base64_authorization_header(Auth_header)
             if token is not None:
                 decoded = self.decode_base64_authorization_header(token)
                 if decoded is not None:
                     email, pword = self.extract_user_credentials(decoded)
                     if email is not None:
-                        return self.user_object_from_credentials(email, pword)
+                        user = self.user_object_from_credentials(email,
+                                                                 pword)
+                        if user is not None and \
+                                self.credential_cache.ttl > 0:
+                            self.credential_cache.put(Auth_header, user)
+                        return user
         return
@@ -6,6 +6,12 @@ app = Flask(__name__)
 AUTH = Auth()
 
 
+@app.teardown_appcontext
+def remove_db_session(error=None) -> None:
+    """ends the database session of the request"""
+    AUTH._db.remove_session(error)
+
+
 @app.route("/", methods=["GET"], strict_slashes=False)
 def simple_route():
     """returns welcome message"""
@@ -65,9 +71,8 @@ def logout():
     if user_with_session is None or session_id is None:
         abort(403)
 
-    # destroy the session by
-    # updating the corresponding user's session ID to None
-    AUTH.destroy_session(user_with_session.id)
+    # destroy this session, the other sessions of the user stay
+    AUTH.destroy_session(user_with_session.id, session_id)
     return redirect("/")
 
 
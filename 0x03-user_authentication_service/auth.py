@@ -1,25 +1,89 @@
 #!/usr/bin/env python3
 """authentication methods"""
+from collections import namedtuple
 from typing import TypeVar
 from uuid import uuid4
+import os
+import time
 import bcrypt
 from sqlalchemy.orm.exc import NoResultFound
 from db import DB
+from session_store import SessionStore, make_store
 from user import User
 
 
+DEFAULT_ROUNDS = 12
+
+Calibration = namedtuple("Calibration", ["rounds", "budget", "timings"])
+_calibration = None
+
+
+def calibrate(budget: float = 0.25, min_rounds: int = 10,
+              max_rounds: int = 16) -> Calibration:
+    """picks the highest bcrypt cost whose hash takes
+    less than budget seconds on this machine (at least min_rounds).
+    The result, with the seconds measured per cost,
+    is used by every hash made afterwards"""
+    global _calibration
+    timings = {}
+    rounds = min_rounds
+    for cost in range(min_rounds, max_rounds + 1):
+        start = time.perf_counter()
+        bcrypt.hashpw(b"calibration", bcrypt.gensalt(cost))
+        timings[cost] = time.perf_counter() - start
+        if timings[cost] > budget:
+            # every round doubles the time, higher costs are slower
+            break
+        rounds = cost
+    _calibration = Calibration(rounds, budget, timings)
+    return _calibration
+
+
+def calibration() -> Calibration:
+    """returns the last calibration, None if none ran"""
+    return _calibration
+
+
+def current_rounds() -> int:
+    """returns the cost new hashes are made with"""
+    if _calibration is None:
+        return DEFAULT_ROUNDS
+    return _calibration.rounds
+
+
+def hash_rounds(hashed_password: bytes) -> int:
+    """returns the cost a bcrypt hash like b"$2b$12$..." was made with"""
+    if isinstance(hashed_password, str):
+        hashed_password = hashed_password.encode()
+    return int(hashed_password.split(b"$")[2])
+
+
+def _needs_rehash(hashed_password: bytes) -> bool:
+    """checks if a hash was made with a lower cost than the
+    current one. Stronger hashes are kept: a calibration on a
+    loaded machine must not weaken them"""
+    return hash_rounds(hashed_password) < current_rounds()
+
+
 def _hash_password(password: str) -> bytes:
     """hashes a password using bcrypt"""
     password = password.encode()
-    return bcrypt.hashpw(password, bcrypt.gensalt())
+    return bcrypt.hashpw(password, bcrypt.gensalt(current_rounds()))
+
+
+if os.getenv("BCRYPT_LATENCY_BUDGET"):
+    calibrate(float(os.getenv("BCRYPT_LATENCY_BUDGET")))
 
 
 class Auth:
     """Auth class to interact with the authentication database.
     """
 
-    def __init__(self):
+    def __init__(self, sessions: SessionStore = None):
+        """sessions: where sessions are kept,
+        session_store.SESSION_STORE by default"""
         self._db = DB()
+        self._sessions = sessions or make_store(engine=self._db._engine)
 
     def register_user(self, email: str,
                       password: str) -> TypeVar('User'):
@@ -35,12 +99,16 @@ class Auth:
             new_user = self._db.add_user(email, hashedpassword)
 
     def valid_login(self, email: str, password: str) -> bool:
-        """checks if login is correct using bcrypt"""
+        """checks if login is correct using bcrypt
+        a hash made with an older cost is replaced on success"""
         try:
-            password = password.encode()
+            encoded = password.encode()
             this_user = self._db.find_user_by(email=email)
-            password_check: bool = bcrypt.checkpw(password,
+            password_check: bool = bcrypt.checkpw(encoded,
                                                   this_user.hashed_password)
+            if password_check and _needs_rehash(this_user.hashed_password):
+                self._db.update_user(this_user.id,
+                                     hashed_password=_hash_password(password))
             return password_check
 
         except NoResultFound:
@@ -53,14 +121,12 @@ class Auth:
         return generated_uuid
 
     def create_session(self, email: str) -> str:
-        """creates a session id and returns it"""
+        """creates a session id and returns it,
+        a user can have several sessions"""
         generated_id = self._generate_uuid()
         try:
             found_user = self._db.find_user_by(email=email)
-            # update the user,
-            # remember the update_user method does a session commit
-            self._db.update_user(found_user.id,
-                                 session_id=generated_id)
+            self._sessions.create(generated_id, found_user.id)
             return generated_id
 
         except NoResultFound:
@@ -71,19 +137,24 @@ class Auth:
         """gets a user using session_id"""
         if session_id is None:
             return None
+        user_id = self._sessions.get(session_id)
+        if user_id is None:
+            return None
         try:
-            found_user = self._db.find_user_by(session_id=session_id)
+            found_user = self._db.find_user_by(id=user_id)
             return found_user
         except NoResultFound:
             return None
 
-    def destroy_session(self, user_id: str) -> None:
-        """destroys a session by
-        updating the corresponding user's session ID to None"""
-        try:
-            self._db.update_user(user_id, session_id=None)
-        except ValueError:
+    def destroy_session(self, user_id: str,
+                        session_id: str = None) -> None:
+        """destroys the session session_id of a user,
+        every session of the user without it"""
+        if session_id is not None:
+            if self._sessions.get(session_id) == user_id:
+                self._sessions.delete(session_id)
             return None
+        self._sessions.delete_user(user_id)
         return None
 
     def get_reset_password_token(self, email) -> None:
@@ -103,5 +174,7 @@ class Auth:
             registered_user = self._db.find_user_by(reset_token=reset_token)
             hashed_pw = _hash_password(password)
             self._db.update_user(registered_user.id, hashed_password=hashed_pw)
+            # sessions opened with the old password end
+            self._sessions.delete_user(registered_user.id)
         except NoResultFound:
             raise ValueError
@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+"""
+Benchmarks of the user authentication service
+run from this directory, every benchmark works in a temporary one
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import bcrypt
+
+PASSWORD = "password"
+
+
+def in_tmp_dir(func):
+    """runs func in a temporary directory, where a.db is created"""
+    def wrapper(*args, **kwargs):
+        cwd = os.getcwd()
+        sys.path.insert(0, cwd)
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                os.chdir(cwd)
+                sys.path.remove(cwd)
+    wrapper.__doc__ = func.__doc__
+    return wrapper
+
+
+def make_users(engine, count: int, chunk: int = 50000,
+               session_ids: bool = False) -> None:
+    """stores count users straight into the users table,
+    their password hash is a cheap one.
+    session_ids: set users.session_id too, as sessions were
+    kept before session_store"""
+    from user import User
+    hashed = bcrypt.hashpw(PASSWORD.encode(), bcrypt.gensalt(4))
+    with engine.begin() as conn:
+        conn.execute(User.__table__.delete())
+        for start in range(0, count, chunk):
+            conn.execute(User.__table__.insert(), [
+                {"email": "user{}@example.com".format(i),
+                 "hashed_password": hashed,
+                 "session_id": ("session-{}".format(i)
+                                if session_ids else None)}
+                for i in range(start, min(start + chunk, count))])
+
+
+def requests_per_sec(send, count: int, requests: int) -> float:
+    """sends requests spread over count users,
+    returns the rate in requests per second"""
+    start = time.perf_counter()
+    for i in range(requests):
+        send((i * 7919) % count)
+    return requests / (time.perf_counter() - start)
+
+
+@in_tmp_dir
+def bench_lookups(counts: tuple = (100000, 1000000),
+                  requests: int = 20) -> None:
+    """GET /profile and POST /sessions without and with
+    the indexes of the users table"""
+    import auth
+    from app import AUTH, app
+    from db import migrate
+    from user import User
+    # no rehash to the default cost on login
+    auth.calibrate(budget=0, min_rounds=4, max_rounds=4)
+    engine = AUTH._db._engine
+    # cookies are sent by hand
+    client = app.test_client(use_cookies=False)
+
+    def profile(i):
+        resp = client.get("/profile", headers={
+            "Cookie": "session_id=session-{}".format(i)})
+        assert resp.status_code == 200
+
+    def login(i):
+        # other users than profile(), logins change the session ids
+        i = (i + count // 2) % count
+        resp = client.post("/sessions", data={
+            "email": "user{}@example.com".format(i), "password": PASSWORD})
+        assert resp.status_code == 200
+
+    for count in counts:
+        print("{} users (requests/sec)".format(count))
+        make_users(engine, count)
+        # sessions of the users profile() asks for
+        for i in {(i * 7919) % count for i in range(requests)}:
+            AUTH._sessions.create("session-{}".format(i), i + 1)
+        for name in ("no index", "indexed"):
+            if name == "indexed":
+                migrate(engine)
+            else:
+                for index in User.__table__.indexes:
+                    index.drop(engine, checkfirst=True)
+            profile_rate = requests_per_sec(profile, count, requests)
+            login_rate = requests_per_sec(login, count, requests)
+            print("{:>12} GET /profile {:>10.1f}  POST /sessions {:>10.1f}"
+                  .format(name, profile_rate, login_rate))
+
+
+def _worker_load(args: tuple) -> int:
+    """worker process of bench_workers: registers users,
+    looks them up and gives them a session"""
+    worker, ops = args
+    from db import DB
+    db = DB(schema="keep")
+    for i in range(ops):
+        email = "worker{}-{}@example.com".format(worker, i)
+        db.add_user(email, "hashed")
+        user = db.find_user_by(email=email)
+        db.update_user(user.id, session_id="{}-{}".format(worker, i))
+    return ops
+
+
+@in_tmp_dir
+def bench_workers(workers: tuple = (1, 2, 4), ops: int = 200) -> None:
+    """worker processes sharing one database file"""
+    from multiprocessing import Pool
+    from db import DB
+    from user import User
+    print("{} registrations per worker (operations/sec)".format(ops))
+    for count in workers:
+        db = DB(schema="reset")
+        start = time.perf_counter()
+        with Pool(count) as pool:
+            done = sum(pool.map(_worker_load,
+                                [(worker, ops) for worker in range(count)]))
+        elapsed = time.perf_counter() - start
+        stored = db._session.query(User).filter(
+            User.session_id.isnot(None)).count()
+        assert stored == done == count * ops, (stored, done)
+        print("{:>12} workers {:>10.1f}".format(count, done * 3 / elapsed))
+
+
+@in_tmp_dir
+def stress_threads(threads: tuple = (1, 2, 4, 8), users: int = 25) -> None:
+    """requests from many threads through the app: every user
+    registers, logs in, reads the profile and logs out"""
+    import auth
+    from app import AUTH, app
+    from user import User
+    auth.calibrate(budget=0, min_rounds=4, max_rounds=4)
+    print("{} users per thread (requests/sec)".format(users))
+    for count in threads:
+        with AUTH._db._engine.begin() as conn:
+            conn.execute(User.__table__.delete())
+        errors = []
+        session_ids = []
+
+        def load(worker):
+            client = app.test_client(use_cookies=False)
+            try:
+                for i in range(users):
+                    email = "thread{}-{}@example.com".format(worker, i)
+                    form = {"email": email, "password": PASSWORD}
+                    resp = client.post("/users", data=form)
+                    assert resp.get_json()["message"] == "user created"
+                    resp = client.post("/sessions", data=form)
+                    assert resp.status_code == 200
+                    cookie = {"Cookie": resp.headers["Set-Cookie"]
+                              .split(";")[0]}
+                    session_ids.append(cookie["Cookie"].split("=")[1])
+                    resp = client.get("/profile", headers=cookie)
+                    assert resp.get_json() == {"email": email}
+                    resp = client.delete("/sessions", headers=cookie)
+                    assert resp.status_code == 302
+                    resp = client.get("/profile", headers=cookie)
+                    assert resp.status_code == 403
+            except Exception as e:
+                errors.append(e)
+
+        workers = [threading.Thread(target=load, args=(worker,))
+                   for worker in range(count)]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+        assert not errors, repr(errors[0])
+        session = AUTH._db._session
+        assert session.query(User).count() == count * users
+        # every session ended with its logout
+        assert len(session_ids) == count * users
+        assert all(AUTH._sessions.get(session_id) is None
+                   for session_id in session_ids)
+        AUTH._db.remove_session()
+        print("{:>12} threads {:>10.1f}".format(
+            count, count * users * 5 / elapsed))
+
+
+@in_tmp_dir
+def bench_update(count: int = 100000, updates: int = 2000) -> None:
+    """session id updates: loading the user per attribute (the
+    former update_user), one UPDATE, and update_users batches"""
+    from db import DB
+    db = DB()
+    make_users(db._engine, count)
+    print("{} users (updates/sec)".format(count))
+
+    def orm_update(user_id, **kwargs):
+        for k, v in kwargs.items():
+            user = db.find_user_by(id=user_id)
+            setattr(user, k, v)
+        db._session.commit()
+
+    ids = [(i * 7919) % count + 1 for i in range(updates)]
+    for name, update in (("load per attribute", orm_update),
+                         ("single UPDATE", db.update_user)):
+        start = time.perf_counter()
+        for user_id in ids:
+            update(user_id, session_id="{}-{}".format(name, user_id),
+                   reset_token=None)
+        elapsed = time.perf_counter() - start
+        db.remove_session()
+        print("{:>20} {:>10.1f}".format(name, updates / elapsed))
+
+    start = time.perf_counter()
+    for i in range(0, updates, 500):
+        assert db.update_users({
+            user_id: {"session_id": "batch-{}".format(user_id)}
+            for user_id in ids[i:i + 500]}) == len(set(ids[i:i + 500]))
+    elapsed = time.perf_counter() - start
+    print("{:>20} {:>10.1f}".format("batches of 500", updates / elapsed))
+
+
+class RespStub:
+    """in-process server speaking enough of the Redis protocol
+    for session_store.RedisSessionStore, on a free local port"""
+
+    def __init__(self) -> None:
+        import socketserver
+        self.data = {}
+        self.expiry = {}
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            disable_nagle_algorithm = True
+
+            def handle(self):
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    args = []
+                    for _ in range(int(line[1:])):
+                        size = int(self.rfile.readline()[1:])
+                        args.append(self.rfile.read(size + 2)[:-2].decode())
+                    self.wfile.write(stub.reply(args))
+
+        self.server = socketserver.ThreadingTCPServer(
+            ("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = "redis://127.0.0.1:{}/0".format(
+            self.server.server_address[1])
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+
+    def _get(self, key: str):
+        """value of a key, None once expired"""
+        if self.expiry.get(key, float("inf")) <= time.monotonic():
+            self.data.pop(key, None)
+            self.expiry.pop(key, None)
+        return self.data.get(key)
+
+    def reply(self, args: list) -> bytes:
+        """RESP reply to a command"""
+        command, args = args[0].upper(), args[1:]
+        with self.lock:
+            if command in ("PING", "SELECT"):
+                return b"+OK\r\n"
+            if command == "SET":
+                self.data[args[0]] = args[1]
+                self.expiry.pop(args[0], None)
+                if len(args) > 3 and args[2].upper() == "EX":
+                    self.expiry[args[0]] = time.monotonic() + int(args[3])
+                return b"+OK\r\n"
+            if command == "GET":
+                value = self._get(args[0])
+                if value is None:
+                    return b"$-1\r\n"
+                return b"$%d\r\n%s\r\n" % (len(value), value.encode())
+            if command == "DEL":
+                count = sum(self.data.pop(key, None) is not None
+                            for key in args)
+                return b":%d\r\n" % count
+            if command == "EXPIRE":
+                self.expiry[args[0]] = time.monotonic() + int(args[1])
+                return b":1\r\n"
+            if command in ("SADD", "SREM", "SMEMBERS"):
+                members = self._get(args[0]) or set()
+                if command == "SMEMBERS":
+                    return b"*%d\r\n" % len(members) + b"".join(
+                        b"$%d\r\n%s\r\n" % (len(m), m.encode())
+                        for m in members)
+                before = len(members)
+                if command == "SADD":
+                    members |= set(args[1:])
+                else:
+                    members -= set(args[1:])
+                self.data[args[0]] = members
+                return b":%d\r\n" % abs(len(members) - before)
+        return b"-ERR unknown command\r\n"
+
+    def close(self) -> None:
+        """stops the server"""
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@in_tmp_dir
+def bench_sessions(count: int = 100000, lookups: int = 20000) -> None:
+    """session lookups of every store, and the former lookup
+    of the users table by session_id"""
+    from db import DB
+    from session_store import (MemorySessionStore, RedisSessionStore,
+                               SQLSessionStore)
+    db = DB()
+    make_users(db._engine, count, session_ids=True)
+    stub = RespStub()
+    stores = (("memory", MemorySessionStore()),
+              ("sql", SQLSessionStore(db._engine)),
+              ("redis protocol", RedisSessionStore(stub.url)))
+    print("{} sessions (lookups/sec)".format(count))
+    ids = [(i * 7919) % count for i in range(lookups)]
+
+    start = time.perf_counter()
+    for i in ids[:lookups // 10]:
+        assert db.find_user_by(
+            session_id="session-{}".format(i)).id == i + 1
+    elapsed = time.perf_counter() - start
+    print("{:>20} {:>10.1f}".format("users table", lookups // 10 / elapsed))
+
+    for name, store in stores:
+        for i in range(count):
+            store.create("session-{}".format(i), i + 1)
+        # a second session of the same users
+        store.create("other-1", 2)
+        start = time.perf_counter()
+        for i in ids:
+            assert store.get("session-{}".format(i)) == i + 1
+        elapsed = time.perf_counter() - start
+        store.delete("session-1")
+        assert store.get("session-1") is None
+        assert store.get("other-1") == 2
+        store.delete_user(2)
+        assert store.get("other-1") is None
+        print("{:>20} {:>10.1f}".format(name, lookups / elapsed))
+    stub.close()
+
+
+BENCHMARKS = {
+    "lookups": bench_lookups,
+    "workers": bench_workers,
+    "stress": stress_threads,
+    "update": bench_update,
+    "sessions": bench_sessions,
+}
+
+
+if __name__ == "__main__":
+    # ./benchmark.py [name ...], all of them by default.
+    # app.py opens a.db once per process, in the directory of the
+    # first benchmark: each benchmark gets its own process
+    names = sys.argv[1:] or list(BENCHMARKS)
+    if len(names) == 1:
+        BENCHMARKS[names[0]]()
+    else:
+        import subprocess
+        for name in names:
+            subprocess.run([sys.executable, __file__, name], check=True)
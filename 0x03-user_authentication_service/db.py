@@ -1,44 +1,156 @@
 #!/usr/bin/env python3
 """DB module
 """
-from typing import Any, Dict, TypeVar
-from sqlalchemy import create_engine
+from os import getenv
+from typing import Any, Dict, Hashable, List, TypeVar
+import threading
+from flask import g, has_app_context
+from sqlalchemy import bindparam, create_engine, event, inspect
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import scoped_session, sessionmaker
 from sqlalchemy.orm.session import Session
+from sqlalchemy.pool import QueuePool, StaticPool
 
 from user import Base
 from user import User
 
+DB_URL = getenv("AUTH_DB_URL", "sqlite:///a.db")
+# "reset" drops and creates the tables on every DB(),
+# "keep" only creates what is missing and keeps the rows:
+# use it to share the database between worker processes
+SCHEMA_MODES = ("reset", "keep")
+DB_SCHEMA = getenv("AUTH_DB_SCHEMA", "reset")
+# seconds a SQLite connection waits for the lock of another one
+BUSY_TIMEOUT = float(getenv("AUTH_DB_BUSY_TIMEOUT", "30"))
+# connections kept open, extra ones allowed under load,
+# and seconds a session waits for a free connection
+POOL_SIZE = int(getenv("AUTH_DB_POOL_SIZE", "5"))
+POOL_MAX_OVERFLOW = int(getenv("AUTH_DB_POOL_MAX_OVERFLOW", "10"))
+POOL_TIMEOUT = float(getenv("AUTH_DB_POOL_TIMEOUT", "30"))
+# names update_user accepts
+USER_COLUMNS = frozenset(User.__table__.columns.keys())
+
+
+def make_engine(url: str = DB_URL) -> Engine:
+    """creates an engine over a pool of POOL_SIZE connections,
+    SQLite databases are opened in WAL mode (readers do not block
+    the writer) with a busy timeout"""
+    pool = {"poolclass": QueuePool, "pool_size": POOL_SIZE,
+            "max_overflow": POOL_MAX_OVERFLOW, "pool_timeout": POOL_TIMEOUT,
+            "pool_pre_ping": True}
+    if not url.startswith("sqlite"):
+        return create_engine(url, echo=False, **pool)
+    if url in ("sqlite://", "sqlite:///:memory:"):
+        # a database in memory lives in its connection: every
+        # thread shares the one connection
+        return create_engine(url, echo=False, poolclass=StaticPool,
+                             connect_args={"check_same_thread": False})
+    # pooled connections are used by one thread at a time
+    engine = create_engine(url, echo=False,
+                           connect_args={"timeout": BUSY_TIMEOUT,
+                                         "check_same_thread": False},
+                           **pool)
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        """runs on every new SQLite connection"""
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA busy_timeout={}".format(
+            int(BUSY_TIMEOUT * 1000)))
+        cursor.close()
+
+    return engine
+
+
+def migrate(engine: Engine) -> List[str]:
+    """creates the tables and indexes missing from the database,
+    rows already stored are kept.
+    Returns the names of the indexes created.
+    A unique index fails with IntegrityError on duplicate values,
+    they have to be cleaned up first"""
+    for attempt in range(3):
+        try:
+            Base.metadata.create_all(engine)
+            created = []
+            for table in Base.metadata.sorted_tables:
+                existing = {index["name"] for index in
+                            inspect(engine).get_indexes(table.name)}
+                for index in sorted(table.indexes, key=lambda i: i.name):
+                    if index.name not in existing:
+                        index.create(engine)
+                        created.append(index.name)
+            return created
+        except OperationalError:
+            # another process created it first, look again
+            if attempt == 2:
+                raise
+
+
+def _session_scope() -> Hashable:
+    """a session per Flask app context (per request),
+    per thread outside of Flask"""
+    if has_app_context():
+        return g._get_current_object()
+    return threading.get_ident()
+
 
 class DB:
     """DB class
     """
 
-    def __init__(self) -> None:
+    def __init__(self, url: str = None, schema: str = None) -> None:
         """Initialize a new DB instance
+        url: database URL, DB_URL by default
+        schema: one of SCHEMA_MODES, DB_SCHEMA by default
         """
-        self._engine = create_engine("sqlite:///a.db", echo=False)
-        Base.metadata.drop_all(self._engine)
-        Base.metadata.create_all(self._engine)
-        self.__session = None
+        schema = schema or DB_SCHEMA
+        if schema not in SCHEMA_MODES:
+            raise ValueError("schema must be one of {}".format(
+                ", ".join(SCHEMA_MODES)))
+        self._engine = make_engine(url or DB_URL)
+        if schema == "reset":
+            Base.metadata.drop_all(self._engine)
+            Base.metadata.create_all(self._engine)
+        else:
+            migrate(self._engine)
+        # objects stay readable once their request committed
+        self._sessions = scoped_session(
+            sessionmaker(bind=self._engine, expire_on_commit=False),
+            scopefunc=_session_scope)
 
     @property
     def _session(self) -> Session:
-        """Memoized session object
+        """Session of the current request or thread
         """
-        if self.__session is None:
-            DBSession = sessionmaker(bind=self._engine)
-            self.__session = DBSession()
-        return self.__session
+        return self._sessions()
+
+    def _commit(self) -> None:
+        """commits the session, rolls it back on error"""
+        try:
+            self._session.commit()
+        except Exception:
+            self._session.rollback()
+            raise
+
+    def remove_session(self, error: BaseException = None) -> None:
+        """ends the session of the current request or thread,
+        what it did not commit is rolled back.
+        Registered as teardown of the Flask app context"""
+        if error is not None:
+            self._session.rollback()
+        self._sessions.remove()
 
     def add_user(self, email: str,
                  hashed_password: str) -> TypeVar('User'):
         """adds new user and returns a User object"""
         new_user = User(email, hashed_password)
         self._session.add(new_user)
-        self._session.commit()
+        self._commit()
         return new_user
 
     def find_user_by(self,
@@ -52,17 +164,66 @@ class DB:
             raise NoResultFound
         return found_user
 
+    @staticmethod
+    def _check_columns(names) -> None:
+        """raises ValueError unless every name is a users column"""
+        if not USER_COLUMNS.issuperset(names):
+            raise ValueError("unknown columns: {}".format(
+                ", ".join(sorted(set(names) - USER_COLUMNS))))
+
     def update_user(self, user_id: int,
-                    **kwargs: Dict[str, Any]) -> None:
-        """updates desired user specified by user id"""
-        for k, v in kwargs.items():
-            try:
-                found_user = self.find_user_by(id=user_id)
-            except NoResultFound:
-                raise NoResultFound
-            # set attribute of the found user
-            if hasattr(found_user, k):
-                setattr(found_user, k, v)
-            else:
-                raise ValueError
-        self._session.commit()
+                    **kwargs: Dict[str, Any]) -> int:
+        """updates desired user specified by user id
+        in one UPDATE statement, the user is not loaded.
+        Returns the number of rows updated"""
+        if not kwargs:
+            return 0
+        self._check_columns(kwargs)
+        try:
+            # users already loaded in the session get the new values
+            updated = self._session.query(User).filter(
+                User.id == user_id).update(kwargs,
+                                           synchronize_session="evaluate")
+        except Exception:
+            self._session.rollback()
+            raise
+        if updated == 0:
+            self._session.rollback()
+            raise NoResultFound
+        self._commit()
+        return updated
+
+    def update_users(self, updates: Dict[int, Dict[str, Any]]) -> int:
+        """updates many users in one transaction, users changing
+        the same columns share one executemany UPDATE
+        updates: {user id: {column: value}}
+        Returns the number of rows updated, missing users are skipped"""
+        batches = {}
+        for user_id, values in updates.items():
+            self._check_columns(values)
+            if values:
+                batches.setdefault(tuple(sorted(values)), []).append(
+                    dict(values, _id=user_id))
+        updated = 0
+        try:
+            for columns, params in batches.items():
+                statement = User.__table__.update().where(
+                    User.id == bindparam("_id")).values(
+                        {column: bindparam(column) for column in columns})
+                updated += self._session.execute(statement, params).rowcount
+        except Exception:
+            self._session.rollback()
+            raise
+        self._commit()
+        # users already loaded in the session are read again
+        for obj in list(self._session.identity_map.values()):
+            if isinstance(obj, User) and obj.id in updates:
+                self._session.expire(obj)
+        return updated
+
+
+if __name__ == "__main__":
+    import sys
+    path = sys.argv[1] if len(sys.argv) > 1 else "a.db"
+    for name in migrate(make_engine("sqlite:///{}".format(path))):
+        print("created {}".format(name))
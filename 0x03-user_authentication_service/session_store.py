@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""Session store module
+sessions map a session id to a user id until they expire,
+a user can have many of them
+"""
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from os import getenv
+from typing import Optional
+from urllib.parse import urlparse
+import socket
+import threading
+import time
+
+from sqlalchemy.engine import Engine
+
+from user import UserSession
+
+# "memory", "sql" or "redis"
+SESSION_STORE = getenv("AUTH_SESSION_STORE", "sql")
+# seconds a session lasts
+SESSION_TTL = int(getenv("AUTH_SESSION_TTL", "86400"))
+# sessions the memory store keeps, the least recently used go first
+SESSION_MAX = int(getenv("AUTH_SESSION_MAX", "100000"))
+REDIS_URL = getenv("AUTH_REDIS_URL", "redis://localhost:6379/0")
+
+
+class SessionStoreError(Exception):
+    """raised when a store cannot be reached or refuses a command"""
+
+
+class SessionStore(ABC):
+    """interface of the session stores"""
+
+    def __init__(self, ttl: int = SESSION_TTL) -> None:
+        """ttl: seconds a session lasts"""
+        self.ttl = ttl
+
+    @abstractmethod
+    def create(self, session_id: str, user_id: int) -> None:
+        """stores a new session of user_id"""
+
+    @abstractmethod
+    def get(self, session_id: str) -> Optional[int]:
+        """returns the user id of a session, None if there is
+        no such session or it expired"""
+
+    @abstractmethod
+    def delete(self, session_id: str) -> None:
+        """ends one session"""
+
+    @abstractmethod
+    def delete_user(self, user_id: int) -> None:
+        """ends every session of a user"""
+
+
+class MemorySessionStore(SessionStore):
+    """sessions in memory, in least recently used order.
+    Private to the process: use it with a single worker"""
+
+    def __init__(self, ttl: int = SESSION_TTL,
+                 max_sessions: int = SESSION_MAX) -> None:
+        """max_sessions: sessions kept, the least recently
+        used are dropped first"""
+        super().__init__(ttl)
+        self.max_sessions = max_sessions
+        # session id -> (user id, expiry)
+        self._sessions = OrderedDict()
+        # user id -> {session id}
+        self._users = {}
+        self._lock = threading.Lock()
+
+    def _drop(self, session_id: str) -> None:
+        """removes a session, lock held"""
+        entry = self._sessions.pop(session_id, None)
+        if entry is not None:
+            sessions = self._users.get(entry[0])
+            sessions.discard(session_id)
+            if not sessions:
+                del self._users[entry[0]]
+
+    def create(self, session_id: str, user_id: int) -> None:
+        """stores a new session of user_id"""
+        with self._lock:
+            self._drop(session_id)
+            self._sessions[session_id] = (user_id,
+                                          time.monotonic() + self.ttl)
+            self._users.setdefault(user_id, set()).add(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._drop(next(iter(self._sessions)))
+
+    def get(self, session_id: str) -> Optional[int]:
+        """returns the user id of a session"""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            if entry[1] <= time.monotonic():
+                self._drop(session_id)
+                return None
+            self._sessions.move_to_end(session_id)
+            return entry[0]
+
+    def delete(self, session_id: str) -> None:
+        """ends one session"""
+        with self._lock:
+            self._drop(session_id)
+
+    def delete_user(self, user_id: int) -> None:
+        """ends every session of a user"""
+        with self._lock:
+            for session_id in list(self._users.get(user_id, ())):
+                self._drop(session_id)
+
+
+class SQLSessionStore(SessionStore):
+    """sessions in the sessions table of the database,
+    shared by every worker using it"""
+
+    # expired rows are purged once every so many creations
+    PURGE_EVERY = 1000
+
+    def __init__(self, engine: Engine, ttl: int = SESSION_TTL) -> None:
+        """engine: database holding the sessions table,
+        created by DB() like the other tables"""
+        super().__init__(ttl)
+        self._engine = engine
+        self._table = UserSession.__table__
+        self._created = 0
+
+    def create(self, session_id: str, user_id: int) -> None:
+        """stores a new session of user_id"""
+        now = time.time()
+        with self._engine.begin() as conn:
+            conn.execute(self._table.insert(), {
+                "session_id": session_id, "user_id": user_id,
+                "expires_at": now + self.ttl})
+            self._created += 1
+            if self._created % self.PURGE_EVERY == 0:
+                conn.execute(self._table.delete().where(
+                    self._table.c.expires_at <= now))
+
+    def get(self, session_id: str) -> Optional[int]:
+        """returns the user id of a session"""
+        with self._engine.connect() as conn:
+            row = conn.execute(
+                self._table.select().where(
+                    self._table.c.session_id == session_id)).first()
+        if row is None:
+            return None
+        if row.expires_at <= time.time():
+            self.delete(session_id)
+            return None
+        return row.user_id
+
+    def delete(self, session_id: str) -> None:
+        """ends one session"""
+        with self._engine.begin() as conn:
+            conn.execute(self._table.delete().where(
+                self._table.c.session_id == session_id))
+
+    def delete_user(self, user_id: int) -> None:
+        """ends every session of a user"""
+        with self._engine.begin() as conn:
+            conn.execute(self._table.delete().where(
+                self._table.c.user_id == user_id))
+
+
+class RedisSessionStore(SessionStore):
+    """sessions in a server speaking the Redis protocol (RESP):
+    session:<id> holds the user id and user_sessions:<user id>
+    the set of its sessions, both expire with the session"""
+
+    def __init__(self, url: str = REDIS_URL, ttl: int = SESSION_TTL,
+                 timeout: float = 5.0) -> None:
+        """url: redis://host:port/db"""
+        super().__init__(ttl)
+        parsed = urlparse(url)
+        self.address = (parsed.hostname or "localhost", parsed.port or 6379)
+        self.database = int(parsed.path.strip("/") or 0)
+        self.timeout = timeout
+        # a connection per thread
+        self._local = threading.local()
+
+    def _connection(self):
+        """socket and reader of the current thread"""
+        if getattr(self._local, "sock", None) is None:
+            try:
+                sock = socket.create_connection(self.address, self.timeout)
+            except OSError as e:
+                raise SessionStoreError(e)
+            # small pipelined commands, do not wait to fill packets
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._local.sock = sock
+            self._local.reader = sock.makefile("rb")
+            if self.database:
+                self._execute(("SELECT", self.database))
+        return self._local.sock, self._local.reader
+
+    def _close(self) -> None:
+        """drops the connection of the current thread"""
+        sock = getattr(self._local, "sock", None)
+        if sock is not None:
+            self._local.reader.close()
+            sock.close()
+        self._local.sock = None
+
+    @staticmethod
+    def _encode(command: tuple) -> bytes:
+        """a command as a RESP array of bulk strings"""
+        parts = [b"*%d\r\n" % len(command)]
+        for arg in command:
+            arg = str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        return b"".join(parts)
+
+    def _read(self, reader):
+        """reads one reply"""
+        line = reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise SessionStoreError("connection closed")
+        kind, value = line[:1], line[1:-2]
+        if kind == b"+":
+            return value.decode()
+        if kind == b"-":
+            raise SessionStoreError(value.decode())
+        if kind == b":":
+            return int(value)
+        if kind == b"$":
+            if int(value) < 0:
+                return None
+            data = reader.read(int(value) + 2)
+            return data[:-2].decode()
+        if kind == b"*":
+            if int(value) < 0:
+                return None
+            return [self._read(reader) for _ in range(int(value))]
+        raise SessionStoreError("bad reply {!r}".format(line))
+
+    def _execute(self, *commands: tuple) -> list:
+        """sends commands in one write (pipelined),
+        returns their replies"""
+        sock, reader = self._connection()
+        try:
+            sock.sendall(b"".join(self._encode(c) for c in commands))
+            replies = [self._read(reader) for _ in commands]
+        except (OSError, SessionStoreError) as e:
+            # the connection may be out of sync, open a new one next time
+            self._close()
+            raise SessionStoreError(e)
+        return replies
+
+    def create(self, session_id: str, user_id: int) -> None:
+        """stores a new session of user_id"""
+        user_key = "user_sessions:{}".format(user_id)
+        self._execute(
+            ("SET", "session:" + session_id, user_id, "EX", self.ttl),
+            ("SADD", user_key, session_id),
+            ("EXPIRE", user_key, self.ttl))
+
+    def get(self, session_id: str) -> Optional[int]:
+        """returns the user id of a session"""
+        user_id = self._execute(("GET", "session:" + session_id))[0]
+        return None if user_id is None else int(user_id)
+
+    def delete(self, session_id: str) -> None:
+        """ends one session"""
+        user_id = self.get(session_id)
+        if user_id is not None:
+            self._execute(("DEL", "session:" + session_id),
+                          ("SREM", "user_sessions:{}".format(user_id),
+                           session_id))
+
+    def delete_user(self, user_id: int) -> None:
+        """ends every session of a user"""
+        user_key = "user_sessions:{}".format(user_id)
+        session_ids = self._execute(("SMEMBERS", user_key))[0]
+        keys = ["session:" + session_id for session_id in session_ids]
+        self._execute(("DEL", user_key, *keys))
+
+
+def make_store(kind: str = None, engine: Engine = None) -> SessionStore:
+    """session store of a kind, SESSION_STORE by default
+    engine: database of the "sql" store"""
+    kind = kind or SESSION_STORE
+    if kind == "memory":
+        return MemorySessionStore()
+    if kind == "sql":
+        return SQLSessionStore(engine)
+    if kind == "redis":
+        return RedisSessionStore()
+    raise ValueError("unknown session store: {}".format(kind))
@@ -1,20 +1,26 @@
 #!/usr/bin/env python3
 """User Module"""
 from typing import Any
-from sqlalchemy import Column, Integer, String
+from sqlalchemy import Column, Float, ForeignKey, Integer, String
 from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()
 
 
 class User(Base):
-    """Mapped User class"""
+    """Mapped User class
+    every lookup column has a unique index (see db.migrate
+    for databases created before them)"""
     __tablename__ = 'users'
     id = Column(Integer, primary_key=True)
-    email = Column(String(length=250))
+    email = Column(String(length=250), unique=True, index=True)
     hashed_password = Column(String(length=250), nullable=False)
-    session_id = Column(String(length=250), nullable=True)
-    reset_token = Column(String(length=250), nullable=True)
+    # sessions are kept by session_store, the column stays
+    # for the clients of the users table that still set it
+    session_id = Column(String(length=250), nullable=True,
+                        unique=True, index=True)
+    reset_token = Column(String(length=250), nullable=True,
+                         unique=True, index=True)
 
     def __init__(self, email: str,
                  hashed_password: str,
@@ -26,3 +32,14 @@ class User(Base):
         self.hashed_password = hashed_password
         self.session_id = session_id
         self.reset_token = reset_token
+
+
+class UserSession(Base):
+    """Mapped session of a user, stored by
+    session_store.SQLSessionStore"""
+    __tablename__ = 'sessions'
+    session_id = Column(String(length=250), primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'),
+                     nullable=False, index=True)
+    # unix time
+    expires_at = Column(Float, nullable=False, index=True)